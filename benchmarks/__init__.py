@@ -0,0 +1,2 @@
+#openbot\benchmarks\__init__.py
+#空文件
\ No newline at end of file
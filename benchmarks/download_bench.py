@@ -0,0 +1,256 @@
+# openbot\benchmarks\download_bench.py
+"""
+离线下载压测：用模拟的 Telethon 客户端驱动 mt_downloader._scrape_and_run (/dl 流水线)
+与 at_downloader.mtproto_download_logic (转发自动保存)，无需真实账号即可复现地比较调度/并发参数。
+
+在项目根目录运行：
+    python -m benchmarks.download_bench --mode mt --jobs 2 --files 300 --concurrency 10 --job-cap 5
+    python -m benchmarks.download_bench --mode at --files 200 --flood-rate 0.02 --seed 7
+
+输出：吞吐 (MB/s、文件/秒)、事件循环延迟 (p99/最大)、内存峰值 (tracemalloc)、Bot 发送/编辑次数、注入的 FloodWait 次数。
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path: sys.path.insert(0, BASE_DIR)
+
+from telethon import errors, types
+from core import flood_control, parallel_transfer
+from core.catalog import DownloadCatalog
+from core.disk_guard import DiskGuard
+from core.download_scheduler import DownloadScheduler
+from core.media_index import media_index
+from core.progress_board import get_board
+import features.downloader.at_downloader as at
+import features.downloader.mt_downloader as mt
+
+ADMIN_CHAT = 10001
+MB = 1024 ** 2
+
+# ===================== 模拟网络 =====================
+class Link:
+    """账号级共享带宽：所有下载分片排队占用同一条链路"""
+    def __init__(self, mbps):
+        self.rate = mbps * MB
+        self.next_free = 0.0
+
+    async def transfer(self, nbytes):
+        if not self.rate: return
+        now = asyncio.get_running_loop().time()
+        start = max(now, self.next_free)
+        self.next_free = start + nbytes / self.rate
+        await asyncio.sleep(self.next_free - now)
+
+class FakeMessage:
+    """只实现两个下载器用到的 Message 字段"""
+    def __init__(self, msg_id, chat_id, size, grouped_id=None, text=""):
+        self.id = msg_id
+        self.chat_id = chat_id
+        self.grouped_id = grouped_id
+        self.message = text
+        self.forward = None
+        doc = types.Document(
+            id=chat_id * 10**7 + msg_id, access_hash=0, file_reference=b"", date=None,
+            mime_type="video/mp4", size=size, dc_id=2,
+            attributes=[types.DocumentAttributeFilename(file_name=f"{msg_id}.mp4")]
+        )
+        self.media = types.MessageMediaDocument(document=doc)
+        self.file = SimpleNamespace(size=size)
+
+class FakeClient:
+    """
+    模拟 TelegramClient：iter_messages / get_messages / get_entity / download_media。
+    每次 RPC 附加 latency；以 flood_rate 概率注入 FloodWait：默认按 Telethon 阈值内的行为在客户端内自动休眠，
+    --flood-raise 时抛出 FloodWaitError (超过阈值的长等待)，由 core.flood_control 退避重试；
+    下载按 1MB 分片受单文件带宽与账号总带宽双重限制，并逐片回调进度。
+    """
+    CHUNK = MB
+
+    def __init__(self, args, rng):
+        self.args = args
+        self.rng = rng
+        self.link = Link(args.total_mbps)
+        self.chats = {}
+        self.rpc_calls = 0
+        self.flood_waits = 0
+        self.bytes = 0
+
+    def add_chat(self, chat_id, count):
+        msgs, gid = [], None
+        for msg_id in range(1, count + 1):
+            if gid is None and self.rng.random() < self.args.album_rate: gid = chat_id * 10**7 + msg_id
+            elif gid is not None and self.rng.random() < 0.3: gid = None
+            size = max(1024, int(self.rng.lognormvariate(0, self.args.size_sigma) * self.args.size_mb * MB))
+            msgs.append(FakeMessage(msg_id, chat_id, size, gid))
+        self.chats[chat_id] = msgs
+        return msgs
+
+    async def _rpc(self):
+        self.rpc_calls += 1
+        await asyncio.sleep(self.args.latency_ms / 1000)
+        if self.rng.random() < self.args.flood_rate:
+            self.flood_waits += 1
+            if self.args.flood_raise: raise errors.FloodWaitError(request=None, capture=int(self.args.flood_secs))
+            await asyncio.sleep(self.args.flood_secs)
+
+    async def get_entity(self, key):
+        await self._rpc()
+        return SimpleNamespace(id=key, title=f"bench_{key}")
+
+    async def iter_messages(self, ent, search=None, min_id=0, offset_id=0, **kwargs):
+        msgs = [m for m in reversed(self.chats[ent.id]) if m.id > (min_id or 0) and (not offset_id or m.id < offset_id)]
+        for i in range(0, len(msgs), 100):
+            await self._rpc()
+            for m in msgs[i:i + 100]:
+                if search and search.lower() not in m.message.lower(): continue
+                yield m
+
+    async def get_messages(self, ent, ids=None, **kwargs):
+        await self._rpc()
+        by_id = {m.id: m for m in self.chats[getattr(ent, "id", ent)]}
+        if isinstance(ids, list): return [by_id.get(i) for i in ids]
+        return by_id.get(ids)
+
+    async def download_media(self, message, file=None, progress_callback=None, **kwargs):
+        await self._rpc()
+        size, done = message.file.size, 0
+        while done < size:
+            chunk = min(self.CHUNK, size - done)
+            await asyncio.gather(self.link.transfer(chunk), asyncio.sleep(chunk / (self.args.file_mbps * MB)))
+            done += chunk
+            if progress_callback:
+                r = progress_callback(done, size)
+                if asyncio.iscoroutine(r): await r
+        # 稀疏文件：只占目录项，不真正写入 size 字节
+        with open(file, "wb") as f: f.truncate(size)
+        self.bytes += size
+        return file
+
+class FakeBot:
+    """统计 send_message 与 edit_text 次数"""
+    def __init__(self):
+        self.sends = 0
+        self.edits = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sends += 1
+        return SimpleNamespace(edit_text=self._edit)
+
+    async def _edit(self, text, **kwargs):
+        self.edits += 1
+
+# ===================== 场景 =====================
+async def _lag_probe(samples, interval=0.05):
+    loop = asyncio.get_running_loop()
+    while True:
+        t = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - t - interval)
+
+async def run_mt(args, client, bot):
+    """并发跑 jobs 个 /dl all 任务，每个任务一个频道"""
+    jobs = []
+    for jid in range(1, args.jobs + 1):
+        chat_id = 1000 + jid
+        client.add_chat(chat_id, args.files)
+        task_key = f"{ADMIN_CHAT}_{jid}"
+        mt.batch_controls[task_key] = mt._new_control(jid, "all")
+        jobs.append(mt._scrape_and_run(client, bot, ADMIN_CHAT, chat_id, "all", False, jid, task_key))
+    await asyncio.gather(*jobs)
+
+async def run_at(args, client, bot):
+    """模拟管理员一次转发 files 条媒体给账号：逐条走 mt_on_new_message 入批次队列"""
+    msgs = client.add_chat(ADMIN_CHAT, args.files)
+    at.mt_on_new_message.manager = SimpleNamespace(
+        config={"ADMIN_ID": str(ADMIN_CHAT)}, bot_app=SimpleNamespace(bot=bot),
+        download_scheduler=mt.scheduler, disk_guard=mt.disk_guard
+    )
+    for m in msgs:
+        await at.mt_on_new_message(SimpleNamespace(is_private=True, sender_id=ADMIN_CHAT, message=m, client=client))
+    while at.USER_BATCH_SESSIONS: await asyncio.sleep(0.05)
+
+async def _drain_boards(bot):
+    board = get_board(bot)
+    while any(p.dirty for chat in list(board._chats.values()) for p in chat["panels"]):
+        await asyncio.sleep(0.1)
+
+async def main(args):
+    rng = random.Random(args.seed)
+    work = tempfile.mkdtemp(prefix="openbot_bench_")
+    # 所有落盘路径重定向到临时目录
+    mt.DOWNLOAD_DIR = os.path.join(work, "download")
+    at.BASE_DIR = work
+    media_index.db_path = os.path.join(work, "media_index.db")
+    # 两个插件按名字导入了 catalog 单例：替换为临时库，并与线上一样运行批量提交循环
+    mt.catalog = at.catalog = catalog = DownloadCatalog(os.path.join(work, "catalog.db"))
+    mt.task_store = mt.TaskStore(os.path.join(work, "tasks.db"))
+    mt.task_store.open()
+    mt.scheduler = DownloadScheduler(size=args.concurrency, job_cap=args.job_cap)
+    mt.disk_guard = DiskGuard(path=work, min_free_bytes=0)
+    # 模拟客户端没有 MTProtoSender，统一走单流 download_media
+    parallel_transfer.PARALLEL_MIN_SIZE = float("inf")
+
+    client, bot = FakeClient(args, rng), FakeBot()
+    lag = []
+    store_task = asyncio.create_task(mt.task_store.run())
+    catalog_task = asyncio.create_task(catalog.run())
+    probe = asyncio.create_task(_lag_probe(lag))
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        await (run_mt if args.mode == "mt" else run_at)(args, client, bot)
+        elapsed = time.perf_counter() - started
+        await _drain_boards(bot)
+    finally:
+        _, mem_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        probe.cancel()
+        await mt.task_store.close()
+        await catalog.close()
+        store_task.cancel()
+        catalog_task.cancel()
+        if not args.keep: shutil.rmtree(work, ignore_errors=True)
+
+    lag.sort()
+    files = args.files * (args.jobs if args.mode == "mt" else 1)
+    print(f"📊 场景: {args.mode} | 任务 {args.jobs if args.mode == 'mt' else 1} | 文件 {files} | "
+          f"并发 {args.concurrency}/{args.job_cap} | seed {args.seed}")
+    print(f"⏱ 耗时: {elapsed:.2f}s")
+    print(f"⚡ 吞吐: {client.bytes / MB / elapsed:.2f} MB/s | {files / elapsed:.1f} 文件/s")
+    print(f"🔁 事件循环延迟: p99 {lag[int(len(lag) * 0.99)] * 1000 if lag else 0:.1f}ms | 最大 {lag[-1] * 1000 if lag else 0:.1f}ms")
+    print(f"🧠 内存峰值: {mem_peak / MB:.1f} MB")
+    print(f"✉️ Bot 发送 {bot.sends} 次 | 编辑 {bot.edits} 次")
+    print(f"📡 RPC {client.rpc_calls} 次 | FloodWait {client.flood_waits} 次 | 已下载 {client.bytes / MB:.1f} MB")
+    print(flood_control.get_control(client).report())
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="OpenBot 离线下载压测")
+    p.add_argument("--mode", choices=("mt", "at"), default="mt", help="mt=/dl 流水线，at=转发自动保存")
+    p.add_argument("--jobs", type=int, default=2, help="mt 模式下并发任务数")
+    p.add_argument("--files", type=int, default=200, help="每个任务的媒体条数")
+    p.add_argument("--concurrency", type=int, default=10, help="全局下载槽位 (DL_CONCURRENCY)")
+    p.add_argument("--job-cap", type=int, default=5, help="单任务槽位上限 (DL_JOB_CONCURRENCY)")
+    p.add_argument("--latency-ms", type=float, default=80, help="每次 RPC 往返延迟")
+    p.add_argument("--file-mbps", type=float, default=4, help="单文件下载带宽 MB/s")
+    p.add_argument("--total-mbps", type=float, default=40, help="账号总带宽 MB/s，0 为不限")
+    p.add_argument("--size-mb", type=float, default=2, help="文件体积中位数 MB (对数正态)")
+    p.add_argument("--size-sigma", type=float, default=1.0, help="文件体积对数正态 sigma")
+    p.add_argument("--album-rate", type=float, default=0.1, help="开启相册的概率")
+    p.add_argument("--flood-rate", type=float, default=0.0, help="每次 RPC 注入 FloodWait 的概率")
+    p.add_argument("--flood-secs", type=float, default=3, help="FloodWait 时长 (秒)")
+    p.add_argument("--flood-raise", action="store_true", help="FloodWait 以异常抛出 (模拟超过 Telethon 自动休眠阈值)")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--keep", action="store_true", help="保留临时下载目录")
+    return p.parse_args(argv)
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,202 @@
+# openbot\core\catalog.py
+import asyncio
+import itertools
+import logging
+import mimetypes
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime
+from core.sqlite_writer import BatchedSQLiteWriter
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DOWNLOAD_DIR = os.path.join(BASE_DIR, "download")
+CATALOG_PATH = os.path.join(DOWNLOAD_DIR, "catalog.db")
+
+# 下载过程/处理阶段产生的边车文件 (含 media_pipeline 的 .remux.mp4 / .720p.mp4 产物)，不进目录
+_SIDECAR = re.compile(r'(\.temp|\.parts|\.parts\.tmp|\.json|\.thumb\.jpg|\.remux\.mp4|\.720p\.mp4|\.db|\.db-wal|\.db-shm)$', re.I)
+_SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3}
+_TYPE_PREFIX = {"video": "video/", "photo": "image/", "image": "image/", "audio": "audio/", "doc": "application/"}
+
+def _parse_size(text):
+    m = re.match(r'^(\d+(?:\.\d+)?)([KMG]?)B?$', text.upper())
+    return int(float(m.group(1)) * _SIZE_UNITS[m.group(2)]) if m else None
+
+def _parse_date(text):
+    try: return int(datetime.strptime(text, "%Y-%m-%d").timestamp())
+    except ValueError: return None
+
+def _ext(name):
+    return os.path.splitext(name)[1].lstrip(".").lower()
+
+class DownloadCatalog(BatchedSQLiteWriter):
+    """
+    已下载文件目录：路径、体积、MIME、说明文字、来源会话、消息 ID、日期，
+    FTS5 (trigram，中英文子串均可检索) 建全文索引，普通列上建过滤索引，百万级文件查询仍是毫秒级。
+    写入与 TaskStore 一样经 BatchedSQLiteWriter 入队批量提交，首次访问时才打开数据库。
+    """
+    FLUSH_INTERVAL = 1.0
+    FLUSH_BATCH = 500
+    THREAD_NAME = "catalog"
+    LABEL = "文件目录"
+    BACKFILL_BATCH = 1000
+
+    def __init__(self, db_path=CATALOG_PATH):
+        super().__init__(db_path)
+        self.fts_trigram = True
+
+    # ---------- 线程侧 ----------
+    def _db(self):
+        if self._conn is None:
+            conn = self._connect_sync()
+            conn.execute('''CREATE TABLE IF NOT EXISTS files
+                            (id INTEGER PRIMARY KEY, path TEXT UNIQUE, name TEXT, ext TEXT, size INTEGER, mime TEXT,
+                             caption TEXT, chat_id INTEGER, chat_name TEXT, msg_id INTEGER, date INTEGER)''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_files_chat ON files (chat_id, msg_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_files_date ON files (date)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_files_size ON files (size)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_files_ext ON files (ext)")
+            conn.execute("CREATE TABLE IF NOT EXISTS catalog_meta (key TEXT PRIMARY KEY, value TEXT)")
+            try:
+                conn.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5
+                                (name, caption, chat_name, content='files', content_rowid='id', tokenize='trigram')''')
+            except sqlite3.OperationalError:
+                # SQLite < 3.34 没有 trigram 分词器
+                self.fts_trigram = False
+                conn.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5
+                                (name, caption, chat_name, content='files', content_rowid='id')''')
+            conn.executescript('''
+                CREATE TRIGGER IF NOT EXISTS files_ai AFTER INSERT ON files BEGIN
+                    INSERT INTO files_fts (rowid, name, caption, chat_name) VALUES (new.id, new.name, new.caption, new.chat_name);
+                END;
+                CREATE TRIGGER IF NOT EXISTS files_ad AFTER DELETE ON files BEGIN
+                    INSERT INTO files_fts (files_fts, rowid, name, caption, chat_name) VALUES ('delete', old.id, old.name, old.caption, old.chat_name);
+                END;
+                CREATE TRIGGER IF NOT EXISTS files_au AFTER UPDATE ON files BEGIN
+                    INSERT INTO files_fts (files_fts, rowid, name, caption, chat_name) VALUES ('delete', old.id, old.name, old.caption, old.chat_name);
+                    INSERT INTO files_fts (rowid, name, caption, chat_name) VALUES (new.id, new.name, new.caption, new.chat_name);
+                END;''')
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _write_sync(self, rows):
+        db = self._db()
+        db.executemany('''INSERT INTO files (path, name, ext, size, mime, caption, chat_id, chat_name, msg_id, date)
+                          VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                          ON CONFLICT(path) DO UPDATE SET size = excluded.size, mime = excluded.mime,
+                              caption = excluded.caption, chat_id = excluded.chat_id, chat_name = excluded.chat_name,
+                              msg_id = excluded.msg_id, date = excluded.date''', rows)
+        db.commit()
+
+    def _backfill_done_sync(self):
+        return self._db().execute("SELECT 1 FROM catalog_meta WHERE key = 'backfill_done'").fetchone() is not None
+
+    def _mark_backfilled_sync(self):
+        db = self._db()
+        db.execute("INSERT OR REPLACE INTO catalog_meta VALUES ('backfill_done', ?)", (str(int(time.time())),))
+        db.commit()
+
+    @staticmethod
+    def _scan(root):
+        """遍历下载目录产出待补录的行；由 backfill() 在默认线程池中分批推进，不占用目录库线程"""
+        for dirpath, _, files in os.walk(root):
+            rel = os.path.relpath(dirpath, root).split(os.sep)
+            # download/{source_id}/{chat_name}/文件
+            source = int(rel[0]) if rel and re.match(r'^-?\d+$', rel[0]) else None
+            chat_name = rel[1] if len(rel) > 1 else None
+            for name in files:
+                if _SIDECAR.search(name): continue
+                path = os.path.join(dirpath, name)
+                try: st = os.stat(path)
+                except OSError: continue
+                msg_id = re.search(r'(?:^|_)(\d+)(?:\.\w+)?$', name)
+                yield (path, name, _ext(name), st.st_size, mimetypes.guess_type(name)[0], None, source, chat_name,
+                       int(msg_id.group(1)) if msg_id else None, int(st.st_mtime))
+
+    def _insert_missing(self, rows):
+        db = self._db()
+        cur = db.executemany('''INSERT OR IGNORE INTO files (path, name, ext, size, mime, caption, chat_id, chat_name, msg_id, date)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+        db.commit()
+        return cur.rowcount
+
+    # ---------- 事件循环侧 ----------
+    def add(self, path, message, chat_id, chat_name) -> None:
+        """文件落盘后调用：只入内存队列，由 run() 批量提交"""
+        file = getattr(message, "file", None)
+        date = getattr(message, "date", None)
+        self._push((
+            path, os.path.basename(path), _ext(path), getattr(file, "size", None), getattr(file, "mime_type", None),
+            getattr(message, "message", None) or None, chat_id, chat_name, message.id,
+            int(date.timestamp()) if date else int(time.time())
+        ))
+
+    async def backfill(self, root=DOWNLOAD_DIR, force=False) -> int:
+        """扫描已有下载目录补录 (只补缺失的路径)，默认只在首次启用时执行一次"""
+        try:
+            if not force and await self._call(self._backfill_done_sync): return 0
+            loop = asyncio.get_running_loop()
+            rows = self._scan(root)
+            added = 0
+            # 每批扫描完就提交，检索请求可以插在批次之间执行，不必等整棵目录遍历结束
+            while True:
+                batch = await loop.run_in_executor(None, lambda: list(itertools.islice(rows, self.BACKFILL_BATCH)))
+                if not batch: break
+                added += await self._call(self._insert_missing, batch)
+            await self._call(self._mark_backfilled_sync)
+            if added: logger.info(f"📚 文件目录补录完成，新增 {added} 个文件")
+            return added
+        except Exception as e:
+            logger.error(f"❌ 文件目录补录失败: {e}")
+            return 0
+
+    def _build_query(self, text, limit):
+        """
+        解析查询：普通词走全文检索，过滤条件：
+        chat:<ID或名称>  type:video|photo|audio|doc  ext:mp4  size>100M  size<1G  after:2024-01-01  before:2024-12-31
+        """
+        where, params, words = [], [], []
+        for tok in text.split():
+            key, sep, val = tok.partition(":")
+            if sep and key.lower() == "chat" and val:
+                if re.match(r'^-?\d+$', val): where.append("f.chat_id = ?"); params.append(int(val))
+                else: where.append("f.chat_name LIKE ?"); params.append(f"%{val}%")
+            elif sep and key.lower() == "type" and val.lower() in _TYPE_PREFIX:
+                where.append("f.mime LIKE ?"); params.append(_TYPE_PREFIX[val.lower()] + "%")
+            elif sep and key.lower() == "ext" and val:
+                where.append("f.ext = ?"); params.append(val.lstrip(".").lower())
+            elif sep and key.lower() in ("after", "before") and _parse_date(val) is not None:
+                where.append("f.date >= ?" if key.lower() == "after" else "f.date < ?"); params.append(_parse_date(val))
+            elif re.match(r'^size[<>]', tok, re.I) and _parse_size(tok[5:]) is not None:
+                where.append("f.size > ?" if tok[4] == ">" else "f.size < ?"); params.append(_parse_size(tok[5:]))
+            else:
+                words.append(tok)
+
+        sql = "SELECT f.path, f.size, f.chat_name, f.msg_id, f.date FROM files f"
+        fts_words = [w for w in words if len(w) >= 3 or not self.fts_trigram]
+        if fts_words:
+            sql += " JOIN files_fts ON files_fts.rowid = f.id"
+            where.insert(0, "files_fts MATCH ?")
+            params.insert(0, " ".join('"' + w.replace('"', '""') + '"' for w in fts_words))
+        for w in words:
+            # trigram 无法匹配不足 3 个字符的词，退化为 LIKE
+            if w in fts_words: continue
+            where.append("(f.name LIKE ? OR f.caption LIKE ?)"); params += [f"%{w}%", f"%{w}%"]
+        if where: sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY f.date DESC LIMIT ?"
+        params.append(limit)
+        return sql, params
+
+    async def search(self, text, limit=20):
+        sql, params = self._build_query(text, limit)
+        return await self._call(self._query_sync, sql, params)
+
+    async def count(self):
+        rows = await self._call(self._query_sync, "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files", ())
+        return rows[0]
+
+catalog = DownloadCatalog()
@@ -4,6 +4,10 @@ import asyncio
 from typing import Optional
 from telegram.ext import Application
 from core.mtproto_client import MTProtoClient
+from core.catalog import catalog
+from core.disk_guard import DiskGuard
+from core.download_scheduler import DownloadScheduler
+from core.media_pipeline import media_pipeline
 from core.plugin_scanner import load_plugins
 
 logger = logging.getLogger(__name__)
@@ -14,6 +18,20 @@ class ClientManager:
         self.loop = loop
         self.bot_app: Optional[Application] = None
         self.mtproto_client: Optional[MTProtoClient] = None
+        # 💡 插件停机钩子：{模块名: 协程函数}，按模块名登记，热重载时覆盖而不是重复追加
+        self.shutdown_hooks = {}
+        # 💡 全局下载调度：所有下载插件共享同一组槽位，按任务公平轮转
+        self.download_scheduler = DownloadScheduler(
+            size=int(self.config.get("DL_CONCURRENCY", 10)),
+            job_cap=int(self.config.get("DL_JOB_CONCURRENCY", 5))
+        )
+        # 💡 磁盘准入：剩余空间低于 DL_MIN_FREE_GB 时所有下载挂起，空间释放后自动继续
+        self.disk_guard = DiskGuard(
+            min_free_bytes=int(float(self.config.get("DL_MIN_FREE_GB", 2)) * 1024**3),
+            notify=self.notify_admin
+        )
+        # 💡 下载后媒体处理 (可选)：MEDIA_PROCESS=probe,thumb,remux,transcode，进程池大小 MEDIA_WORKERS
+        media_pipeline.configure(self.config.get("MEDIA_PROCESS", "").split(","), int(self.config.get("MEDIA_WORKERS", 2)))
 
     async def start_all(self) -> None:
         """启动系统：按顺序初始化 Bot 和 MTProto"""
@@ -47,6 +65,10 @@ class ClientManager:
         # 4. 扫描并注册插件 (传入 manager 实例供 register 函数使用)
         load_plugins(self) 
         
+        # 💡 已下载文件目录：后台批量写入，首次启用时补录已有下载
+        asyncio.create_task(catalog.run())
+        asyncio.create_task(catalog.backfill())
+
         # 5. 启动 Bot 轮询
         await self.bot_app.initialize()
         await self.bot_app.start()
@@ -57,6 +79,13 @@ class ClientManager:
         """安全停止所有服务，并销毁内存残留"""
         logger.info("🛑 正在执行系统停机清理...")
         
+        # 💡 先让插件落盘积压写入 (任务库等)，再断开连接
+        for name, hook in list(self.shutdown_hooks.items()):
+            try:
+                await hook()
+            except Exception as e:
+                logger.error(f"插件停机清理异常 [{name}]: {e}")
+
         if self.bot_app:
             try:
                 # 💡 停止轮询并释放 Bot 资源
@@ -73,11 +102,23 @@ class ClientManager:
                 await self.mtproto_client.stop()
             except Exception as e:
                 logger.error(f"MTProto 断开异常: {e}")
+
+        await media_pipeline.close()
+        await catalog.close()
         
         # 💡 极致安全：强制清空内存引用，确保登录凭据不留痕迹
         self.bot_app = None
         self.mtproto_client = None
 
+    async def notify_admin(self, text: str) -> None:
+        """向 ADMIN_ID 推送系统告警"""
+        admin_id = self.config.get("ADMIN_ID")
+        if not admin_id or not self.bot: return
+        try:
+            await self.bot.send_message(int(admin_id), text, parse_mode="HTML")
+        except Exception as e:
+            logger.error(f"管理员告警发送失败: {e}")
+
     @property
     def bot(self):
         """快捷访问底层的 Bot 对象"""
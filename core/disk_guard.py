@@ -0,0 +1,82 @@
+# openbot\core\disk_guard.py
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from core.fs_service import fs_service
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DOWNLOAD_DIR = os.path.join(BASE_DIR, "download")
+
+class DiskGuard:
+    """
+    下载准入控制：每个文件开始下载前，按 document.size 预留空间，
+    剩余空间 (扣除进行中文件的预留) 低于水位线时该文件挂起，直到空间释放后自动继续。
+    进入/解除低空间状态时通过 notify 向管理员告警。
+    """
+    POLL = 30            # 空间不足时的复查间隔 (秒)
+    ALERT_COOLDOWN = 600 # 低空间告警最小间隔 (秒)
+
+    def __init__(self, path=DOWNLOAD_DIR, min_free_bytes=2 * 1024**3, notify=None):
+        self.path = path
+        self.min_free = min_free_bytes
+        self.notify = notify
+        self.reserved = 0
+        self.waiting = 0
+        self._alerted = False
+        self._last_alert = 0
+
+    async def free_bytes(self) -> int:
+        try: return await fs_service.disk_free(self.path)
+        except OSError as e:
+            logger.error(f"❌ 磁盘空间查询失败: {e}")
+            return 1 << 62
+
+    async def fits(self, size) -> bool:
+        return await self.free_bytes() - self.reserved - (size or 0) >= self.min_free
+
+    async def _alert(self, text):
+        if not self.notify: return
+        try: await self.notify(text)
+        except Exception as e: logger.error(f"❌ 磁盘告警发送失败: {e}")
+
+    async def acquire(self, size) -> None:
+        size = size or 0
+        waited = False
+        while True:
+            free = await self.free_bytes()
+            # 判定与预留之间没有 await：并发的多个文件不会同时通过同一份剩余空间
+            if free - self.reserved - size >= self.min_free: break
+            if not waited: waited, self.waiting = True, self.waiting + 1
+            now = time.time()
+            if not self._alerted or now - self._last_alert > self.ALERT_COOLDOWN:
+                self._alerted, self._last_alert = True, now
+                logger.warning(f"💾 磁盘空间不足 ({free / 1024**3:.1f} GB)，下载已暂停")
+                await self._alert(
+                    f"⚠️ <b>磁盘空间不足，下载已自动暂停</b>\n"
+                    f"• 剩余: {free / 1024**3:.2f} GB (水位线 {self.min_free / 1024**3:.1f} GB)\n"
+                    f"• 等待中的文件: {self.waiting}\n"
+                    f"释放空间后将自动继续")
+            try: await asyncio.sleep(self.POLL)
+            except asyncio.CancelledError:
+                self.waiting -= 1
+                raise
+        self.reserved += size
+        if waited:
+            self.waiting -= 1
+            if self._alerted and not self.waiting:
+                self._alerted = False
+                logger.info("💾 磁盘空间已恢复，下载继续")
+                await self._alert(f"✅ 磁盘空间已恢复 ({free / 1024**3:.1f} GB)，下载继续")
+
+    def release(self, size) -> None:
+        self.reserved = max(0, self.reserved - (size or 0))
+
+    @asynccontextmanager
+    async def admit(self, size):
+        await self.acquire(size)
+        try: yield
+        finally: self.release(size)
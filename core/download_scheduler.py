@@ -0,0 +1,70 @@
+# openbot\core\download_scheduler.py
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+class DownloadScheduler:
+    """
+    全局下载调度器：所有插件共享同一个 MTProto 账号的 size 个下载槽位。
+    每个任务 (job_key) 同时最多占用 job_cap 个槽位；空闲槽位在有等待者的任务之间轮转分配，
+    避免某个插件的突发任务 (如一次转发 300 个文件) 挤占正在运行的 /dl 任务。
+    """
+    def __init__(self, size: int = 10, job_cap: int = 5):
+        self.size = max(1, size)
+        self.job_cap = max(1, job_cap)
+        self.busy = 0
+        self._by_job = {}
+        self._waiters = OrderedDict()
+
+    def job_busy(self, job_key) -> int:
+        return self._by_job.get(job_key, 0)
+
+    def job_waiting(self, job_key) -> int:
+        return sum(1 for f in self._waiters.get(job_key, ()) if not f.done())
+
+    async def acquire(self, job_key) -> None:
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(job_key, deque()).append(fut)
+        self._dispatch()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            # 已分到槽位但调用方被取消：归还槽位
+            if fut.done() and not fut.cancelled(): self.release(job_key)
+            raise
+
+    def release(self, job_key) -> None:
+        self.busy -= 1
+        left = self.job_busy(job_key) - 1
+        if left > 0: self._by_job[job_key] = left
+        else: self._by_job.pop(job_key, None)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, job_key):
+        await self.acquire(job_key)
+        try: yield
+        finally: self.release(job_key)
+
+    def _dispatch(self) -> None:
+        """轮转分配：依次给每个有等待者、且未达上限的任务一个槽位，分配后该任务移到队尾"""
+        while self.busy < self.size:
+            granted = False
+            for job_key in list(self._waiters):
+                queue = self._waiters[job_key]
+                while queue and queue[0].done(): queue.popleft()
+                if not queue:
+                    self._waiters.pop(job_key, None)
+                    continue
+                if self.job_busy(job_key) >= self.job_cap: continue
+                queue.popleft().set_result(None)
+                self.busy += 1
+                self._by_job[job_key] = self.job_busy(job_key) + 1
+                self._waiters.move_to_end(job_key)
+                if not queue: self._waiters.pop(job_key, None)
+                granted = True
+                break
+            if not granted: return
@@ -0,0 +1,191 @@
+# openbot\core\entity_cache.py
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from telethon import errors, utils
+from telethon.extensions import BinaryReader
+from core import flood_control
+
+logger = logging.getLogger(__name__)
+
+_LINK_PREFIX = re.compile(r'^(?:https?://)?(?:t\.me|telegram\.me)/', re.I)
+
+def _normalize(query):
+    """统一缓存键：数字 ID -> int；@name / t.me/name -> 小写用户名；其余 (邀请链接等) 原样"""
+    if isinstance(query, int): return query
+    q = str(query).strip()
+    if re.match(r'^-?\d+$', q): return int(q)
+    name = _LINK_PREFIX.sub("", q).lstrip("@")
+    if re.match(r'^\w{4,}$', name): return name.lower()
+    return q
+
+# 确定性失败 (用户名不存在/无效、peer 无效、频道不可访问) 才做负缓存
+_DEFINITIVE = (errors.UsernameNotOccupiedError, errors.UsernameInvalidError, errors.PeerIdInvalidError,
+               errors.ChannelInvalidError, errors.ChannelPrivateError, errors.InviteHashInvalidError,
+               errors.InviteHashExpiredError)
+
+def _definitive(e):
+    """
+    Telethon 会把 UsernameNotOccupied 包成 ValueError("No user has ...")，按异常链判断；
+    "Could not find the input entity" 只是当前会话还没见过该 peer，稍后往往自愈，不缓存。
+    """
+    if isinstance(e, _DEFINITIVE) or isinstance(e.__cause__, _DEFINITIVE): return True
+    if isinstance(e, TypeError): return True
+    return isinstance(e, ValueError) and str(e).startswith(("No user has", "Cannot find any entity corresponding to"))
+
+class EntityCache:
+    """
+    实体解析缓存：get_entity 结果按 LRU + TTL 缓存在内存，并以 TL 序列化写入 SQLite，重启后仍然命中。
+    - 解析成功后同时以带标记的 peer_id / 用户名建立别名，换一种写法查询同一实体也不再发 RPC
+    - 不存在的用户名、无权访问的频道等确定性错误做负缓存 (NEGATIVE_TTL)，FloodWait 等临时错误不缓存
+    - 同一键的并发查询合并为一次 RPC
+    """
+    SIZE = 2048
+    TTL = 6 * 3600
+    NEGATIVE_TTL = 600
+
+    def __init__(self, client, db_path=None):
+        self.client = client
+        self.db_path = db_path
+        self._items = OrderedDict()   # key -> (过期时间, 实体 或 None, 错误信息)
+        self._inflight = {}
+        self._loaded = db_path is None
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="entity_cache") if db_path else None
+        self.hits = 0
+        self.misses = 0
+
+    # ---------- 持久化 (线程侧) ----------
+    def _db(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''CREATE TABLE IF NOT EXISTS entities
+                            (key TEXT PRIMARY KEY, expires REAL, data BLOB, error TEXT)''')
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _load_sync(self):
+        db = self._db()
+        db.execute("DELETE FROM entities WHERE expires < ?", (time.time(),))
+        db.commit()
+        return db.execute("SELECT key, expires, data, error FROM entities ORDER BY expires DESC LIMIT ?", (self.SIZE,)).fetchall()
+
+    def _save_sync(self, rows):
+        db = self._db()
+        db.executemany("INSERT OR REPLACE INTO entities VALUES (?, ?, ?, ?)", rows)
+        db.commit()
+
+    async def _call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def _load(self):
+        self._loaded = True
+        try: rows = await self._call(self._load_sync)
+        except Exception as e:
+            logger.error(f"❌ 实体缓存加载失败: {e}")
+            return
+        for key, expires, data, error in reversed(rows):
+            try: entity = BinaryReader(data).tgread_object() if data else None
+            except Exception: continue
+            key = int(key) if re.match(r'^-?\d+$', key) else key
+            # 旧版本写入的原始 ID 别名 (正数键指向频道/群组) 会与用户 ID 冲突，丢弃
+            if entity is not None and isinstance(key, int) and key > 0:
+                try:
+                    if utils.get_peer_id(entity) != key: continue
+                except Exception: continue
+            self._items.setdefault(key, (expires, entity, error))
+        logger.info(f"📇 实体缓存已加载 {len(self._items)} 条")
+
+    # ---------- 内存 LRU ----------
+    def _get(self, key):
+        item = self._items.get(key)
+        if item is None: return None
+        if item[0] < time.time():
+            self._items.pop(key, None)
+            return None
+        self._items.move_to_end(key)
+        return item
+
+    def _put(self, keys, entity, error, ttl):
+        expires = time.time() + ttl
+        rows = []
+        data = bytes(entity) if self._executor and entity is not None else None
+        for key in keys:
+            self._items[key] = (expires, entity, error)
+            self._items.move_to_end(key)
+            rows.append((str(key), expires, data, error))
+        while len(self._items) > self.SIZE: self._items.popitem(last=False)
+        if self._executor:
+            asyncio.get_running_loop().run_in_executor(self._executor, self._save_sync, rows)
+
+    @staticmethod
+    def _aliases(key, entity):
+        # 只用带标记的 peer id：频道的原始正数 id 可能与某个用户 id 相同
+        keys = {key}
+        try: keys.add(utils.get_peer_id(entity))
+        except Exception: pass
+        if getattr(entity, "username", None): keys.add(entity.username.lower())
+        return keys
+
+    # ---------- 对外接口 ----------
+    async def get(self, query):
+        if not self._loaded: await self._load()
+        key = _normalize(query)
+        item = self._get(key)
+        if item:
+            self.hits += 1
+            if item[1] is None: raise ValueError(item[2])
+            return item[1]
+
+        fut = self._inflight.get(key)
+        if fut: return await asyncio.shield(fut)
+        self.misses += 1
+        fut = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            entity = await flood_control.call(self.client, "resolve", self.client.get_entity, query)
+            self._put(self._aliases(key, entity), entity, None, self.TTL)
+            fut.set_result(entity)
+            return entity
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as e:
+            if not _definitive(e):
+                fut.set_exception(e)
+                raise
+            # 确定性失败：负缓存，短时间内重复查询直接失败
+            self._put([key], None, str(e), self.NEGATIVE_TTL)
+            fut.set_exception(ValueError(str(e)))
+            raise
+        finally:
+            self._inflight.pop(key, None)
+            # 没有并发等待者时避免 "Future exception was never retrieved"
+            if fut.done() and not fut.cancelled(): fut.exception()
+
+    def invalidate(self, query):
+        self._items.pop(_normalize(query), None)
+
+_caches = weakref.WeakKeyDictionary()
+
+def register_cache(client, cache: EntityCache):
+    _caches[client] = cache
+
+def get_cache(client) -> EntityCache:
+    """MTProtoClient 会注册带持久化的缓存；其他客户端 (如压测) 得到纯内存缓存"""
+    cache = _caches.get(client)
+    if cache is None:
+        cache = _caches[client] = EntityCache(client)
+    return cache
+
+async def get_entity(client, query):
+    """带缓存的 client.get_entity"""
+    return await get_cache(client).get(query)
@@ -0,0 +1,149 @@
+# openbot\core\flood_control.py
+import asyncio
+import logging
+import random
+import time
+import weakref
+from telethon import errors
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """
+    异步令牌桶：每秒补充 rate 个令牌，最多积攒 burst 个。
+    penalize(seconds) 让整个桶暂停到服务器要求的时间之后，同类请求不再继续撞墙。
+    """
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    async def acquire(self, n: float = 1) -> float:
+        """取令牌，返回为此排队的秒数"""
+        waited = 0.0
+        while True:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                delay = self.blocked_until - now
+            else:
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return waited
+                delay = (n - self.tokens) / self.rate
+            await asyncio.sleep(delay)
+            waited += delay
+
+    def penalize(self, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+class FloodControl:
+    """
+    MTProto 限流层：按请求类别各用一个令牌桶平滑请求速率；
+    服务器返回 FloodWait 时暂停该类别的桶、按服务器给出的时间加随机抖动退避，再重试幂等请求。
+    短于 Telethon flood_sleep_threshold 的等待仍由 Telethon 内部自动休眠。
+    """
+    # 类别: (每秒请求数, 突发容量)
+    LIMITS = {
+        "download": (100, 200),  # GetFile 分片 / download_media
+        "history": (5, 10),      # GetHistory / GetMessages / Search
+        "resolve": (1, 5),       # ResolveUsername / GetChannels，限流最严
+        "other": (10, 20),
+    }
+    RETRIES = 3
+    JITTER = 0.2
+    MAX_WAIT = 3600          # 服务器要求等待超过该值时不再重试，直接抛出
+
+    def __init__(self):
+        self.buckets = {kind: TokenBucket(rate, burst) for kind, (rate, burst) in self.LIMITS.items()}
+        self.stats = {kind: {"calls": 0, "floods": 0, "retries": 0, "flood_secs": 0.0, "queued_secs": 0.0} for kind in self.LIMITS}
+
+    async def throttle(self, kind: str) -> None:
+        stat = self.stats[kind]
+        stat["calls"] += 1
+        stat["queued_secs"] += await self.buckets[kind].acquire()
+
+    async def backoff(self, kind: str, seconds: float) -> None:
+        """FloodWait：暂停同类请求，并按服务器时间 + 抖动休眠"""
+        stat = self.stats[kind]
+        stat["floods"] += 1
+        self.buckets[kind].penalize(seconds)
+        wait = seconds * (1 + random.uniform(0, self.JITTER)) + random.uniform(0, 1)
+        stat["flood_secs"] += wait
+        logger.warning(f"🚦 FloodWait [{kind}] {seconds}s，退避 {wait:.1f}s 后重试")
+        await asyncio.sleep(wait)
+
+    async def call(self, kind: str, fn, *args, retries: int = None, **kwargs):
+        """执行幂等请求：令牌桶限速，FloodWait 退避后最多重试 retries 次"""
+        retries = self.RETRIES if retries is None else retries
+        for attempt in range(retries + 1):
+            await self.throttle(kind)
+            try:
+                return await fn(*args, **kwargs)
+            except errors.FloodWaitError as e:
+                if attempt >= retries or e.seconds > self.MAX_WAIT: raise
+                self.stats[kind]["retries"] += 1
+                await self.backoff(kind, e.seconds)
+
+    async def iter_messages(self, client, entity, page: int = 100, retries: int = None, **kwargs):
+        """
+        可续传的 iter_messages：每页取一个 history 令牌；
+        中途 FloodWait 时退避，再从最后产出的消息之后继续，而不是整段重来。
+        """
+        retries = self.RETRIES if retries is None else retries
+        limit = kwargs.pop("limit", None)
+        last_id, count, attempt = None, 0, 0
+        while True:
+            kw = dict(kwargs)
+            if last_id is not None:
+                if kw.get("reverse"): kw["min_id"] = max(kw.get("min_id") or 0, last_id)
+                else: kw["offset_id"] = last_id
+            if limit is not None: kw["limit"] = limit - count
+            try:
+                await self.throttle("history")
+                async for m in client.iter_messages(entity, **kw):
+                    last_id = m.id
+                    count += 1
+                    yield m
+                    if count % page == 0: await self.throttle("history")
+                return
+            except errors.FloodWaitError as e:
+                attempt += 1
+                if attempt > retries or e.seconds > self.MAX_WAIT: raise
+                self.stats["history"]["retries"] += 1
+                await self.backoff("history", e.seconds)
+
+    def summary(self) -> str:
+        floods = sum(s["floods"] for s in self.stats.values())
+        flood_secs = sum(s["flood_secs"] for s in self.stats.values())
+        queued = sum(s["queued_secs"] for s in self.stats.values())
+        return f"🚦 限流: FloodWait {floods} 次 / 退避 {flood_secs:.0f}s | 令牌桶排队 {queued:.0f}s"
+
+    def report(self) -> str:
+        lines = [self.summary()]
+        for kind, s in self.stats.items():
+            if not s["calls"]: continue
+            lines.append(f"  • {kind}: {s['calls']} 次请求 | FloodWait {s['floods']} 次 ({s['flood_secs']:.0f}s) | "
+                         f"重试 {s['retries']} | 排队 {s['queued_secs']:.1f}s")
+        return "\n".join(lines)
+
+_controls = weakref.WeakKeyDictionary()
+
+def register_control(client, control: FloodControl):
+    _controls[client] = control
+
+def get_control(client) -> FloodControl:
+    """同一账号 (TelegramClient) 共用一组令牌桶"""
+    control = _controls.get(client)
+    if control is None:
+        control = _controls[client] = FloodControl()
+    return control
+
+async def call(client, kind, fn, *args, **kwargs):
+    return await get_control(client).call(kind, fn, *args, **kwargs)
+
+def iter_messages(client, entity, **kwargs):
+    return get_control(client).iter_messages(client, entity, **kwargs)
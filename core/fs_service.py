@@ -0,0 +1,79 @@
+# openbot\core\fs_service.py
+import asyncio
+import logging
+import os
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+_UNSAFE_CHARS = re.compile(r'[\\/:*?"<>|]')
+
+class FileSystemService:
+    """
+    下载落盘的文件系统层：mkdir / stat / rename / 磁盘容量查询全部在线程池执行，
+    NFS、CIFS 等慢挂载上的元数据操作不会卡住事件循环。
+    已创建的目录与清洗后的会话名按会话缓存，同一频道的后续文件不再重复 makedirs / re.sub。
+    """
+    CACHE_LIMIT = 4096
+
+    def __init__(self, workers=4):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fs")
+        self._names = {}
+        self._dirs = set()
+
+    async def _call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def safe_name(self, name) -> str:
+        name = str(name)
+        safe = self._names.get(name)
+        if safe is None:
+            if len(self._names) >= self.CACHE_LIMIT: self._names.clear()
+            safe = self._names[name] = _UNSAFE_CHARS.sub("_", name)
+        return safe
+
+    async def ensure_dir(self, path) -> str:
+        if path not in self._dirs:
+            await self._call(os.makedirs, path, 0o777, True)
+            if len(self._dirs) >= self.CACHE_LIMIT: self._dirs.clear()
+            self._dirs.add(path)
+        return path
+
+    async def chat_dir(self, root, source_id, chat_name) -> str:
+        """download/{原始ID}/{清洗后的会话名}，首次使用时创建"""
+        return await self.ensure_dir(os.path.join(root, str(source_id), self.safe_name(chat_name)))
+
+    async def exists(self, path) -> bool:
+        return await self._call(os.path.exists, path)
+
+    @staticmethod
+    def _rename_sync(src, dst):
+        if not os.path.exists(src): return False
+        os.replace(src, dst)
+        return True
+
+    async def rename(self, src, dst) -> bool:
+        """src 不存在时返回 False，否则原子替换到 dst"""
+        return await self._call(self._rename_sync, src, dst)
+
+    @staticmethod
+    def _remove_sync(path):
+        if not os.path.exists(path): return False
+        os.remove(path)
+        return True
+
+    async def remove(self, path) -> bool:
+        """path 不存在时返回 False，否则删除"""
+        return await self._call(self._remove_sync, path)
+
+    @staticmethod
+    def _free_sync(path):
+        os.makedirs(path, exist_ok=True)
+        return shutil.disk_usage(path).free
+
+    async def disk_free(self, path) -> int:
+        return await self._call(self._free_sync, path)
+
+fs_service = FileSystemService()
@@ -0,0 +1,131 @@
+# openbot\core\job_metrics.py
+import time
+from collections import deque
+
+def _fmt_secs(secs):
+    if secs is None: return "--"
+    secs = int(secs)
+    if secs >= 3600: return f"{secs // 3600}h{secs % 3600 // 60:02d}m"
+    if secs >= 60: return f"{secs // 60}m{secs % 60:02d}s"
+    return f"{secs}s"
+
+def _fmt_latency(secs):
+    return f"{secs:.2f}s" if secs is not None and secs < 60 else _fmt_secs(secs)
+
+class JobMetrics:
+    """
+    单个下载任务的吞吐统计：累计字节、滚动 MB/s 与 文件/分钟、队列深度、剩余字节 ETA、单文件耗时 p50/p95。
+    只在事件循环内同步调用，不做任何 IO，可直接放进进度回调。
+    """
+    WINDOW = 30         # 滚动速率窗口 (秒)
+    LATENCY_KEEP = 500  # 参与分位数计算的最近文件数
+
+    def __init__(self):
+        self.started = time.time()
+        self.bytes_done = 0
+        self.bytes_expected = 0
+        self.files_done = 0
+        self.files_skipped = 0
+        self.files_failed = 0
+        self.files_cancelled = 0
+        self.queued = 0
+        self._inflight = {}   # msg_id -> [开始时间, 已下载字节, 体积]
+        self._byte_samples = deque()
+        self._file_samples = deque()
+        self._latencies = deque(maxlen=self.LATENCY_KEEP)
+
+    # ---------- 流水线埋点 ----------
+    def enqueue(self, size=0):
+        self.queued += 1
+        self.bytes_expected += size or 0
+
+    def dequeue(self):
+        self.queued = max(0, self.queued - 1)
+
+    def start(self, msg_id, size=0):
+        self._inflight[msg_id] = [time.time(), 0, size or 0]
+
+    def progress(self, msg_id, current, total=None):
+        f = self._inflight.get(msg_id)
+        if f is None: return
+        delta = current - f[1]
+        if delta <= 0: return
+        f[1] = current
+        self.bytes_done += delta
+        self._byte_samples.append((time.time(), delta))
+
+    def finish(self, msg_id, ok=True, size=0, cancelled=False):
+        now = time.time()
+        f = self._inflight.pop(msg_id, None)
+        # 未开始下载的文件按入队时的体积扣减预计字节，已开始的只扣剩余部分
+        left = size or 0 if f is None else max(0, f[2] - f[1])
+        if cancelled:
+            self.files_cancelled += 1
+            self.bytes_expected -= left
+        elif f is None:
+            # 未真正下载：成功即已存在/秒存，失败则是下载前就出错
+            if ok: self.files_skipped += 1
+            else: self.files_failed += 1
+            self.bytes_expected -= left
+        elif ok:
+            if f[2] > f[1]:
+                # 单流下载的最后一次回调可能不足总量：按文件体积补齐
+                self.bytes_done += f[2] - f[1]
+                self._byte_samples.append((now, f[2] - f[1]))
+            self.files_done += 1
+            self._file_samples.append(now)
+            self._latencies.append(now - f[0])
+        else:
+            self.files_failed += 1
+            self.bytes_expected -= left
+
+    def abandon(self, msg_id):
+        """兜底：下载中途未经 finish 就退出的文件 (改名失败、重新拉取为空等) 记为失败，不再停留在进行中"""
+        if msg_id in self._inflight: self.finish(msg_id, ok=False)
+
+    # ---------- 指标 ----------
+    def _trim(self, now):
+        edge = now - self.WINDOW
+        while self._byte_samples and self._byte_samples[0][0] < edge: self._byte_samples.popleft()
+        while self._file_samples and self._file_samples[0] < edge: self._file_samples.popleft()
+
+    def _span(self, now):
+        return max(1.0, min(self.WINDOW, now - self.started))
+
+    def rate_bps(self):
+        now = time.time()
+        self._trim(now)
+        return sum(b for _, b in self._byte_samples) / self._span(now)
+
+    def files_per_min(self):
+        now = time.time()
+        self._trim(now)
+        return len(self._file_samples) * 60 / self._span(now)
+
+    def eta(self):
+        rate = self.rate_bps()
+        left = self.bytes_expected - self.bytes_done
+        if rate <= 0 or left <= 0: return None
+        return left / rate
+
+    def percentile(self, p):
+        if not self._latencies: return None
+        data = sorted(self._latencies)
+        return data[min(len(data) - 1, int(len(data) * p / 100))]
+
+    def summary(self):
+        """/dls 列表中的一行"""
+        return (f"⚡ {self.rate_bps() / 1024**2:.2f}MB/s | 📄 {self.files_per_min():.1f}/min | "
+                f"📥 队列 {self.queued} | ⏱ ETA {_fmt_secs(self.eta())}")
+
+    def report(self):
+        """/dls <任务ID> 的详细统计"""
+        return "\n".join([
+            f"⚡ 速率: {self.rate_bps() / 1024**2:.2f} MB/s (近 {self.WINDOW}s)",
+            f"📄 文件: {self.files_per_min():.1f} 个/分钟",
+            f"📦 已下载: {self.bytes_done / 1024**2:.1f} MB / 预计 {self.bytes_expected / 1024**2:.1f} MB",
+            f"✅ 完成 {self.files_done} | 🟢 跳过 {self.files_skipped} | 🔴 失败 {self.files_failed} | ⏹ 取消 {self.files_cancelled} | 🔵 进行中 {len(self._inflight)}",
+            f"📥 队列深度: {self.queued}",
+            f"⏱ 单文件耗时: p50 {_fmt_latency(self.percentile(50))} | p95 {_fmt_latency(self.percentile(95))}",
+            f"⏳ ETA: {_fmt_secs(self.eta())} | 已运行 {_fmt_secs(time.time() - self.started)}",
+        ])
@@ -0,0 +1,107 @@
+# openbot\core\media_index.py
+import asyncio
+import logging
+import os
+import shutil
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INDEX_PATH = os.path.join(BASE_DIR, "download", "media_index.db")
+
+def media_key(message):
+    """内容键：Telegram 文档/图片 ID + 体积，同一文件被转发到任何频道都保持不变"""
+    media = getattr(message, "media", None)
+    doc = getattr(media, "document", None)
+    if doc is not None and getattr(doc, "id", None):
+        return ("doc", doc.id, getattr(doc, "size", 0) or 0)
+    photo = getattr(media, "photo", None)
+    if photo is not None and getattr(photo, "id", None):
+        size = getattr(getattr(message, "file", None), "size", 0) or 0
+        return ("photo", photo.id, size)
+    return None
+
+class MediaIndex:
+    """
+    内容寻址去重索引：记录 (类型, 媒体 ID, 体积) -> 首次落盘路径。
+    新下载前先查索引，已知内容直接硬链接到新位置 (跨分区时复制)，不再重复下载；
+    同名但内容不同的文件改名避让，而不是误报"已存在"。
+    SQLite 与文件系统操作都在专用线程执行。
+    """
+    def __init__(self, db_path=INDEX_PATH):
+        self.db_path = db_path
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="media_index")
+
+    def _db(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''CREATE TABLE IF NOT EXISTS media
+                            (kind TEXT, media_id INTEGER, size INTEGER, path TEXT,
+                             PRIMARY KEY (kind, media_id, size))''')
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    async def _call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    # ---------- 线程侧 ----------
+    def _plan_sync(self, key, path, msg_id):
+        db = self._db()
+        if key:
+            row = db.execute("SELECT path FROM media WHERE kind = ? AND media_id = ? AND size = ?", key).fetchone()
+            if row and os.path.exists(row[0]):
+                src = row[0]
+                if os.path.exists(path) and os.path.samefile(src, path): return "exists", path
+                target = path if not os.path.exists(path) else self._alt_path(path, msg_id)
+                if os.path.exists(target) and os.path.samefile(src, target): return "exists", target
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                try: os.link(src, target)
+                except OSError: shutil.copy2(src, target)
+                return "linked", target
+            if row:
+                db.execute("DELETE FROM media WHERE kind = ? AND media_id = ? AND size = ?", key)
+                db.commit()
+
+        # 索引未命中：同名文件体积一致视为同一内容 (兼容建索引前的旧下载)，否则改名避让
+        for candidate in (path, self._alt_path(path, msg_id)):
+            if not os.path.exists(candidate): return "download", candidate
+            if key and key[2] and os.path.getsize(candidate) == key[2]:
+                self._record_sync(key, candidate)
+                return "exists", candidate
+        return "download", self._alt_path(path, msg_id)
+
+    def _record_sync(self, key, path):
+        db = self._db()
+        db.execute("INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?)", (*key, path))
+        db.commit()
+
+    @staticmethod
+    def _alt_path(path, msg_id):
+        stem, ext = os.path.splitext(path)
+        return f"{stem}_{msg_id}{ext}"
+
+    # ---------- 事件循环侧 ----------
+    async def plan(self, message, path):
+        """
+        下载前决策，返回 (status, path)：
+        exists - 目标已是同一内容；linked - 已从已知副本硬链接；download - 需要下载到返回的路径
+        """
+        try:
+            return await self._call(self._plan_sync, media_key(message), path, message.id)
+        except Exception as e:
+            logger.error(f"❌ 去重索引查询失败: {e}")
+            return ("exists", path) if os.path.exists(path) else ("download", path)
+
+    async def record(self, message, path):
+        key = media_key(message)
+        if not key: return
+        try: await self._call(self._record_sync, key, path)
+        except Exception as e: logger.error(f"❌ 去重索引写入失败: {e}")
+
+media_index = MediaIndex()
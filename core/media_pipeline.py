@@ -0,0 +1,140 @@
+# openbot\core\media_pipeline.py
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import ffmpeg
+except ImportError:  # 可选依赖：未安装 ffmpeg-python 时整个阶段不启用
+    ffmpeg = None
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("probe", "thumb", "remux", "transcode")
+
+# 转码档位：输出文件后缀 -> ffmpeg 输出参数
+PROFILES = {
+    "remux": (".remux.mp4", {"c": "copy", "movflags": "+faststart"}),
+    "transcode": (".720p.mp4", {"vcodec": "libx264", "crf": 23, "preset": "veryfast", "vf": "scale=-2:'min(720,ih)'",
+                                "acodec": "aac", "movflags": "+faststart"}),
+}
+
+# ===================== 子进程侧 (必须是可 pickle 的顶层函数) =====================
+def _process_file(path, stages):
+    """在进程池中执行：ffprobe 元数据 -> 缩略图 -> 可选封装/转码，返回处理摘要"""
+    try:
+        return _run_stages(path, stages)
+    except ffmpeg.Error as e:
+        # ffmpeg.Error 无法跨进程 pickle，转成普通异常并只保留 stderr 末尾
+        raise RuntimeError((e.stderr or b"").decode("utf-8", "ignore").strip()[-200:] or str(e)) from None
+
+def _run_stages(path, stages):
+    stem, _ = os.path.splitext(path)
+    try: info = ffmpeg.probe(path)
+    except ffmpeg.Error: return []  # 非音视频文件 (压缩包、文档等)
+    streams = info.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video" and not s.get("disposition", {}).get("attached_pic")), None)
+    duration = float(info.get("format", {}).get("duration") or 0)
+    done = []
+
+    if "probe" in stages:
+        meta = {
+            "format": info.get("format", {}).get("format_name"),
+            "duration": duration,
+            "bit_rate": info.get("format", {}).get("bit_rate"),
+            "streams": [{k: s.get(k) for k in ("codec_type", "codec_name", "width", "height", "bit_rate")} for s in streams],
+        }
+        with open(path + ".json", "w", encoding="utf-8") as f: json.dump(meta, f, ensure_ascii=False)
+        done.append("probe")
+
+    # 只有视频 (时长 > 0) 需要截图与转码，图片/音频跳过
+    if not video or duration <= 0: return done
+
+    if "thumb" in stages:
+        (ffmpeg.input(path, ss=min(1.0, duration / 2))
+               .output(stem + ".thumb.jpg", vframes=1, vf="scale=320:-2")
+               .overwrite_output().run(quiet=True))
+        done.append("thumb")
+
+    for name in ("remux", "transcode"):
+        if name not in stages: continue
+        suffix, opts = PROFILES[name]
+        if name == "remux" and path.lower().endswith(".mp4"): continue
+        tmp = stem + suffix + ".temp"
+        ffmpeg.input(path).output(tmp, format="mp4", **opts).overwrite_output().run(quiet=True)
+        os.replace(tmp, stem + suffix)
+        done.append(name)
+    return done
+
+# ===================== 事件循环侧 =====================
+class MediaPipeline:
+    """
+    下载后处理阶段：文件落盘后 submit() 入有界队列立即返回，
+    由 workers 个协程把 ffprobe / 截图 / 封装转码 交给进程池执行，CPU 密集工作不占用事件循环。
+    队列写满时丢弃新任务 (只记日志)，绝不反压下载器。
+    """
+    QUEUE_SIZE = 200
+
+    def __init__(self):
+        self.stages = ()
+        self.workers = 2
+        self._pool = None
+        self._queue = None
+        self._consumers = []
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def configure(self, stages, workers=2) -> None:
+        stages = tuple(s for s in (x.strip().lower() for x in stages) if s)
+        unknown = [s for s in stages if s not in STAGES]
+        if unknown: logger.warning(f"⚠️ 未知的媒体处理阶段: {unknown}，可选 {STAGES}")
+        self.stages = tuple(s for s in stages if s in STAGES)
+        self.workers = max(1, workers)
+        if self.stages and ffmpeg is None:
+            logger.warning("⚠️ 未安装 ffmpeg-python，下载后媒体处理已禁用")
+            self.stages = ()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.stages)
+
+    def _start(self):
+        # spawn：子进程不继承事件循环、Telethon 连接与 SQLite 句柄 (fork 多线程进程可能死锁)
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        self._queue = asyncio.Queue(maxsize=self.QUEUE_SIZE)
+        self._consumers = [asyncio.create_task(self._consume()) for _ in range(self.workers)]
+        logger.info(f"🎞 媒体处理已启用: {'/'.join(self.stages)} ({self.workers} 进程)")
+
+    def submit(self, path) -> None:
+        """下载完成后调用：非阻塞，未启用时直接返回"""
+        if not self.enabled: return
+        if self._pool is None: self._start()
+        try: self._queue.put_nowait(path)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning(f"⚠️ 媒体处理队列已满，跳过: {os.path.basename(path)}")
+
+    async def _consume(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            path = await self._queue.get()
+            try:
+                done = await loop.run_in_executor(self._pool, _process_file, path, self.stages)
+                self.processed += 1
+                if done: logger.info(f"🎞 已处理 {os.path.basename(path)}: {', '.join(done)}")
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"❌ 媒体处理失败 {os.path.basename(path)}: {e}")
+
+    async def close(self) -> None:
+        for t in self._consumers: t.cancel()
+        self._consumers = []
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+media_pipeline = MediaPipeline()
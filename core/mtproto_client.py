@@ -3,6 +3,9 @@ import os
 import asyncio
 from telethon import TelegramClient
 from typing import Optional
+from core import parallel_transfer
+from core.entity_cache import EntityCache, register_cache
+from core.flood_control import FloodControl, register_control
 
 logger = logging.getLogger(__name__)
 
@@ -28,6 +31,12 @@ class MTProtoClient:
             timeout=10,
             receive_updates=True
         )
+        # 💡 限流层：按请求类别令牌桶 + FloodWait 退避重试，所有插件共享同一账号的配额
+        self.flood_control = FloodControl()
+        register_control(self.client, self.flood_control)
+        # 💡 实体解析缓存 (LRU + TTL + 负缓存)，持久化在会话目录，所有插件共享
+        self.entity_cache = EntityCache(self.client, os.path.join(session_dir, "entity_cache.db"))
+        register_cache(self.client, self.entity_cache)
     
     async def start(self) -> bool:
         try:
@@ -54,7 +63,16 @@ class MTProtoClient:
         except:
             return False
 
+    async def call(self, kind: str, fn, *args, **kwargs):
+        """限流执行幂等请求：kind 为 download/history/resolve/other，FloodWait 自动退避重试"""
+        return await self.flood_control.call(kind, fn, *args, **kwargs)
+
+    async def get_entity(self, query):
+        """带缓存的实体解析：命中时不发 RPC，重启后仍有效"""
+        return await self.entity_cache.get(query)
+
     async def stop(self) -> None:
+        await parallel_transfer.close_transfer(self.client)
         if self.client and self.client.is_connected():
             await self.client.disconnect()
             logger.info("🔌 MTProto 已安全断开")
\ No newline at end of file
@@ -0,0 +1,206 @@
+# openbot\core\parallel_transfer.py
+import asyncio
+import inspect
+import json
+import logging
+import os
+import threading
+import weakref
+from telethon import utils
+from telethon.network import MTProtoSender
+from telethon.tl.alltlobjects import LAYER
+from telethon.tl.functions import InvokeWithLayerRequest
+from telethon.tl.functions.auth import ExportAuthorizationRequest, ImportAuthorizationRequest
+from telethon.tl.functions.upload import GetFileRequest
+from telethon.tl.types.upload import FileCdnRedirect
+from core import flood_control
+from core.fs_service import fs_service
+
+logger = logging.getLogger(__name__)
+
+PART_SIZE = 1024 * 1024               # upload.getFile 单次上限 1MB，且分片不能跨 1MB 边界
+PARALLEL_MIN_SIZE = 10 * 1024 * 1024  # 小于该体积的文件仍走 Telethon 单流下载
+CONNECTIONS = 4                       # 每个 DC 的并行 sender 连接数
+META_EVERY = 8                        # 每完成 N 个分片刷新一次边车记录
+# 分片下载依赖的 TelegramClient 私有接口；缺失时 (非标准客户端/版本差异) 整体走单流
+_CLIENT_API = ("_get_dc", "_connection", "_call", "_init_request", "_log", "_proxy", "session")
+
+class CdnRedirectError(Exception):
+    """文件被重定向到 CDN，并行模式不处理，交回单流下载"""
+    pass
+
+class _PartFile:
+    """
+    预分配的 .temp 文件 + .parts 边车记录。
+    分片按偏移写入，已完成分片记录在边车 JSON 中，中断后下次从剩余分片继续。
+    所有方法均为同步 IO，只能通过线程池调用。
+    """
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.meta_path = path + ".parts"
+        self.total = (size + PART_SIZE - 1) // PART_SIZE
+        self.done = set()
+        self._fh = None
+        self._lock = threading.Lock()
+
+    def open_sync(self):
+        if os.path.exists(self.path) and os.path.exists(self.meta_path):
+            try:
+                with open(self.meta_path, "r", encoding="utf-8") as f: meta = json.load(f)
+                if meta.get("size") == self.size and meta.get("part_size") == PART_SIZE:
+                    self.done = {i for i in meta.get("done", []) if 0 <= i < self.total}
+            except Exception:
+                self.done = set()
+        # 目录可能在 fs_service 缓存之后被删除 (清理磁盘)：与 Telethon 单流下载一致，自动补建
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._fh = open(self.path, "r+b" if self.done else "w+b")
+        self._fh.truncate(self.size)
+
+    def write_sync(self, index, data):
+        with self._lock:
+            self._fh.seek(index * PART_SIZE)
+            self._fh.write(data)
+
+    def save_meta_sync(self):
+        with self._lock:
+            if self._fh: self._fh.flush()
+            done = sorted(self.done)
+        tmp = self.meta_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"size": self.size, "part_size": PART_SIZE, "done": done}, f)
+        os.replace(tmp, self.meta_path)
+
+    def close_sync(self, finished=False):
+        if not self._fh: return
+        if finished:
+            self._fh.close()
+            if os.path.exists(self.meta_path): os.remove(self.meta_path)
+        else:
+            self.save_meta_sync()
+            self._fh.close()
+        self._fh = None
+
+class ParallelTransfer:
+    """
+    多连接分片下载：向文件所在 DC 建立 CONNECTIONS 个独立 sender，
+    并行请求 upload.getFile 分片并按偏移写入预分配文件，支持断点续传。
+    """
+    def __init__(self, client, connections=CONNECTIONS):
+        self.client = client
+        self.connections = connections
+        self._senders = {}
+        self._auth_keys = {}
+        self._lock = asyncio.Lock()
+        missing = [a for a in _CLIENT_API if not hasattr(client, a)]
+        self.supported = not missing
+        if missing: logger.warning(f"⚠️ 客户端缺少 {missing}，分片并行下载已禁用")
+
+    async def _create_sender(self, dc_id):
+        client = self.client
+        dc = await client._get_dc(dc_id)
+        auth_key = client.session.auth_key if dc_id == client.session.dc_id else self._auth_keys.get(dc_id)
+        sender = MTProtoSender(auth_key, loggers=client._log)
+        await sender.connect(client._connection(dc.ip_address, dc.port, dc.id, loggers=client._log, proxy=client._proxy))
+        if not auth_key:
+            # 跨 DC：导出当前授权并在新连接上导入，之后同 DC 的连接复用该 auth_key
+            auth = await client(ExportAuthorizationRequest(dc_id))
+            client._init_request.query = ImportAuthorizationRequest(id=auth.id, bytes=auth.bytes)
+            await sender.send(InvokeWithLayerRequest(LAYER, client._init_request))
+            self._auth_keys[dc_id] = sender.auth_key
+        return sender
+
+    async def _get_senders(self, dc_id):
+        async with self._lock:
+            # 断线的连接不再复用：整组丢弃后重建
+            if dc_id in self._senders and not all(s.is_connected() for s in self._senders[dc_id]):
+                await self._drop_senders(dc_id)
+            if dc_id not in self._senders:
+                senders = []
+                for _ in range(self.connections): senders.append(await self._create_sender(dc_id))
+                self._senders[dc_id] = senders
+            return self._senders[dc_id]
+
+    async def _drop_senders(self, dc_id):
+        for sender in self._senders.pop(dc_id, []):
+            try: await sender.disconnect()
+            except Exception: pass
+
+    async def close(self):
+        for dc_id in list(self._senders): await self._drop_senders(dc_id)
+
+    async def download(self, message, file, progress_callback=None):
+        doc = getattr(getattr(message, "media", None), "document", None)
+        size = getattr(doc, "size", 0) or 0
+        if not doc or size < PARALLEL_MIN_SIZE or not self.supported:
+            return await self._download_single(message, file, progress_callback)
+
+        dc_id, location = utils.get_input_location(doc)
+        try:
+            senders = await self._get_senders(dc_id)
+            return await self._download_parts(senders, location, file, size, progress_callback)
+        except (CdnRedirectError, ConnectionError) as e:
+            if isinstance(e, ConnectionError):
+                # 连接已失效：剔除该 DC 的 sender，下一个大文件重新建连
+                async with self._lock: await self._drop_senders(dc_id)
+            logger.warning(f"⚠️ 分片并行下载不可用，回退单流下载: {e}")
+            await fs_service.remove(file + ".parts")
+            return await self._download_single(message, file, progress_callback)
+
+    async def _download_single(self, message, file, progress_callback):
+        return await flood_control.call(self.client, "download", self.client.download_media, message, file=file, progress_callback=progress_callback)
+
+    async def _download_parts(self, senders, location, file, size, progress_callback):
+        loop = asyncio.get_running_loop()
+        part_file = _PartFile(file, size)
+        await loop.run_in_executor(None, part_file.open_sync)
+        pending = [i for i in range(part_file.total) if i not in part_file.done]
+        state = {"bytes": min(size, len(part_file.done) * PART_SIZE), "since_meta": 0}
+
+        async def worker(sender):
+            while pending:
+                index = pending.pop(0)
+                request = GetFileRequest(location, offset=index * PART_SIZE, limit=PART_SIZE)
+                result = await flood_control.call(self.client, "download", self.client._call, sender, request)
+                if isinstance(result, FileCdnRedirect): raise CdnRedirectError("CDN redirect")
+                await loop.run_in_executor(None, part_file.write_sync, index, result.bytes)
+                part_file.done.add(index)
+                state["bytes"] = min(size, state["bytes"] + len(result.bytes))
+                state["since_meta"] += 1
+                if state["since_meta"] >= META_EVERY:
+                    state["since_meta"] = 0
+                    await loop.run_in_executor(None, part_file.save_meta_sync)
+                if progress_callback:
+                    r = progress_callback(state["bytes"], size)
+                    if inspect.isawaitable(r): await r
+
+        tasks = [asyncio.create_task(worker(s)) for s in senders]
+        finished = False
+        try:
+            await asyncio.gather(*tasks)
+            finished = len(part_file.done) == part_file.total
+            if not finished: raise IOError(f"分片缺失: {part_file.total - len(part_file.done)}")
+        except BaseException:
+            for t in tasks: t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            await loop.run_in_executor(None, part_file.close_sync, finished)
+        return file
+
+_transfers = weakref.WeakKeyDictionary()
+
+def get_transfer(client) -> ParallelTransfer:
+    """每个 TelegramClient 共用一组分片连接"""
+    transfer = _transfers.get(client)
+    if transfer is None:
+        transfer = _transfers[client] = ParallelTransfer(client)
+    return transfer
+
+async def download_media(client, message, file, progress_callback=None):
+    """大文件走多连接分片下载 (可续传)，其余与 client.download_media 等价"""
+    return await get_transfer(client).download(message, file, progress_callback)
+
+async def close_transfer(client):
+    transfer = _transfers.pop(client, None)
+    if transfer: await transfer.close()
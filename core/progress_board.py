@@ -0,0 +1,135 @@
+# openbot\core\progress_board.py
+import asyncio
+import logging
+import time
+from telegram.error import BadRequest, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+class Panel:
+    """
+    单条看板消息。插件只改自己的内存状态并调用 touch()，从不等待网络；
+    真正的 send/edit 由 ProgressBoard 的会话渲染循环统一完成。
+    """
+    def __init__(self, board, chat_id, render):
+        self.board = board
+        self.chat_id = chat_id
+        self.render = render
+        self.message = None
+        self.last_text = None
+        self.dirty = False
+        self.closed = False
+        self.attached = False
+        self.touched_at = time.time()
+        self.rendered_at = 0.0
+
+    def touch(self):
+        self.dirty = True
+        self.touched_at = time.time()
+        # 长时间空闲被释放的看板 (静默的监控频道、等待磁盘空间的任务) 有新进度时重新挂回
+        if not self.attached: self.board._attach(self)
+        self.board._wake(self.chat_id)
+
+    def close(self):
+        """任务结束：最后渲染一次后从看板服务移除"""
+        self.closed = True
+        self.touch()
+
+class ProgressBoard:
+    """
+    合并式看板渲染服务：每个会话一个渲染循环，每 INTERVAL 秒最多发出一次编辑，
+    同一会话的多个看板按"最久未刷新优先"轮流刷新，因此并发任务再多，每个会话的编辑频率也是常数。
+    遇到 429 (RetryAfter) 按服务器给出的时间退避。
+    """
+    INTERVAL = 1.5      # 同一会话两次编辑的最小间隔 (秒)
+    IDLE_TTL = 600      # 看板超过该时间无变化即释放
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._chats = {}
+        self.edits = 0
+        self.throttled = 0
+
+    def open(self, chat_id, render) -> Panel:
+        panel = Panel(self, chat_id, render)
+        self._attach(panel)
+        return panel
+
+    def _attach(self, panel):
+        chat = self._chats.get(panel.chat_id)
+        if chat is None:
+            chat = self._chats[panel.chat_id] = {"panels": [], "wake": asyncio.Event(), "task": None}
+        chat["panels"].append(panel)
+        panel.attached = True
+        if chat["task"] is None or chat["task"].done():
+            chat["task"] = asyncio.create_task(self._chat_loop(panel.chat_id))
+
+    def _wake(self, chat_id):
+        chat = self._chats.get(chat_id)
+        if chat: chat["wake"].set()
+
+    async def _chat_loop(self, chat_id):
+        chat = self._chats[chat_id]
+        try:
+            while True:
+                dirty = [p for p in chat["panels"] if p.dirty]
+                if not dirty:
+                    now = time.time()
+                    keep = [p for p in chat["panels"] if not p.closed and now - p.touched_at < self.IDLE_TTL]
+                    for p in chat["panels"]:
+                        if p not in keep: p.attached = False
+                    chat["panels"] = keep
+                    if not keep: return
+                    chat["wake"].clear()
+                    try: await asyncio.wait_for(chat["wake"].wait(), timeout=60)
+                    except asyncio.TimeoutError: pass
+                    continue
+                panel = min(dirty, key=lambda p: p.rendered_at)
+                delay = await self._flush(panel)
+                await asyncio.sleep(max(self.INTERVAL, delay))
+        except Exception as e:
+            logger.error(f"❌ 看板渲染循环异常 [{chat_id}]: {e}")
+        finally:
+            if self._chats.get(chat_id) is chat:
+                self._chats.pop(chat_id, None)
+                for p in chat["panels"]: p.attached = False
+
+    async def _flush(self, panel) -> float:
+        """渲染并发送一次；返回需要额外等待的秒数 (429 退避)"""
+        panel.dirty = False
+        panel.rendered_at = time.time()
+        try: text = panel.render()
+        except Exception as e:
+            logger.error(f"❌ 看板渲染失败: {e}")
+            return 0
+        if text == panel.last_text: return 0
+        try:
+            if panel.message: await panel.message.edit_text(text, parse_mode="HTML")
+            else: panel.message = await self.bot.send_message(panel.chat_id, text, parse_mode="HTML")
+            panel.last_text = text
+            self.edits += 1
+        except RetryAfter as e:
+            panel.dirty = True
+            self.throttled += 1
+            wait = e.retry_after
+            return wait.total_seconds() if hasattr(wait, "total_seconds") else float(wait)
+        except BadRequest as e:
+            err = str(e).lower()
+            if "not modified" in err: panel.last_text = text
+            elif "not found" in err:
+                # 看板消息被删：下次重新发送
+                panel.message = None
+                panel.dirty = True
+            else: logger.debug(f"看板编辑被拒绝: {e}")
+        except Exception as e:
+            logger.debug(f"看板发送失败: {e}")
+        return 0
+
+_boards = {}
+
+def get_board(bot) -> ProgressBoard:
+    """每个 Bot 实例共用一个看板服务"""
+    board = _boards.get(id(bot))
+    if board is None or board.bot is not bot:
+        board = _boards[id(bot)] = ProgressBoard(bot)
+    return board
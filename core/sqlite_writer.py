@@ -0,0 +1,100 @@
+# openbot\core\sqlite_writer.py
+import asyncio
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+class BatchedSQLiteWriter:
+    """
+    单线程 SQLite 批量写入器：一条长连接 (WAL)，所有 SQLite 调用都在专用线程里执行。
+    写操作先进入内存队列，由 run() 按周期或积压条数合并成一个事务提交，事件循环只做入队。
+    子类负责建表/迁移；队列项默认是 (sql, params)，批次格式不同时覆盖 _write_sync。
+    """
+    FLUSH_INTERVAL = 1.0   # 批量提交周期 (秒)
+    FLUSH_BATCH = 500      # 积压达到该条数时立即提交
+    THREAD_NAME = "sqlite"
+    LABEL = "数据库"        # 日志中的库名
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=self.THREAD_NAME)
+        self._pending = []
+        self._wakeup = asyncio.Event()
+        self._closed = False
+
+    # ---------- 线程侧 (仅在 _executor 中运行) ----------
+    def _connect_sync(self):
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _db(self):
+        return self._conn
+
+    def _write_sync(self, batch):
+        db = self._db()
+        with db:
+            for sql, params in batch: db.execute(sql, params)
+
+    def _query_sync(self, sql, params):
+        return self._db().execute(sql, params).fetchall()
+
+    def _close_sync(self):
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+    # ---------- 事件循环侧 ----------
+    async def _call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _push(self, item):
+        self._pending.append(item)
+        if len(self._pending) >= self.FLUSH_BATCH: self._wakeup.set()
+
+    def _enqueue(self, sql, params):
+        self._push((sql, params))
+
+    async def flush(self):
+        if not self._pending: return
+        batch, self._pending = self._pending, []
+        try: await self._call(self._write_sync, batch)
+        except Exception as e: logger.error(f"❌ {self.LABEL}写入失败 ({len(batch)} 条): {e}")
+
+    async def run(self):
+        """后台批量提交循环"""
+        while not self._closed:
+            try: await asyncio.wait_for(self._wakeup.wait(), timeout=self.FLUSH_INTERVAL)
+            except asyncio.TimeoutError: pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def query(self, sql, params=()):
+        """读操作前先落盘积压写入，保证读到自己的写"""
+        await self.flush()
+        return await self._call(self._query_sync, sql, params)
+
+    async def close(self):
+        """停机：落盘积压写入后关闭连接与线程"""
+        if self._closed: return
+        self._closed = True
+        await self.flush()
+        await self._call(self._close_sync)
+        self._executor.shutdown(wait=False)
+
+    def close_now(self):
+        """同步版 close：热重载等不在协程里的场景，新实例打开同一个库前先落盘积压写入"""
+        if self._closed: return
+        self._closed = True
+        batch, self._pending = self._pending, []
+        try:
+            if batch: self._executor.submit(self._write_sync, batch).result()
+        except Exception as e: logger.error(f"❌ {self.LABEL}写入失败 ({len(batch)} 条): {e}")
+        self._executor.submit(self._close_sync).result()
+        self._executor.shutdown(wait=False)
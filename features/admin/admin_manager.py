@@ -68,8 +68,9 @@ async def handle_groupinfo(update: Update, context: ContextTypes.DEFAULT_TYPE):
             client = manager.mtproto_client.client
             from telethon.tl.functions.channels import GetFullChannelRequest
             
-            # 使用 update.effective_chat.id，Telethon 会自动处理映射
-            full = await client(GetFullChannelRequest(update.effective_chat.id))
+            # 使用 update.effective_chat.id，先经共享实体缓存解析，避免每次重复 GetChannels
+            channel = await manager.mtproto_client.get_entity(update.effective_chat.id)
+            full = await manager.mtproto_client.call("other", client, GetFullChannelRequest(channel))
             
             title = full.chats[0].title
             count = full.full_chat.participants_count
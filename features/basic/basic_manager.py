@@ -74,8 +74,8 @@ async def handle_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # 智能识别数字 ID (含负号) 或 字符串链接
         search_param = int(target) if re.match(r'^-?\d+$', target) else target
         
-        # MTProto 核心探测
-        entity = await client.get_entity(search_param)
+        # MTProto 核心探测 (走共享实体缓存，重复查询不再发 RPC)
+        entity = await manager.mtproto_client.get_entity(search_param)
         
         # 属性提取与 ID 救助
         raw_id = entity.id
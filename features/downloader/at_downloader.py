@@ -1,67 +1,68 @@
 import logging
 import os
 import asyncio
-import re
 import traceback
-import time
+from collections import deque
 from telethon import events, types
 from telegram import Update
 from telegram.ext import ContextTypes, MessageHandler, filters
+from core import entity_cache, parallel_transfer
+from core.catalog import catalog
 from core.command_registry import register_handler
+from core.fs_service import fs_service
+from core.media_index import media_index
+from core.media_pipeline import media_pipeline
+from core.progress_board import get_board
 from core.utils import is_admin
 
 logger = logging.getLogger(__name__)
 
 __MODULE_NAME__ = "MTProto转发自动机器人保存引擎"
 
-# 全局存储，用于追踪用户的当前批次
+# 全局存储，用于追踪用户的当前批次 (批次空闲后自动释放)
 USER_BATCH_SESSIONS = {}
+BATCH_IDLE = 3.0    # 队列清空且 N 秒无新文件即结束批次
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # ===================== UI 智能看板 (批次版) =====================
 class IndependentUI:
+    DISPLAY_LIMIT = 8
+
     def __init__(self, bot, chat_id, title="📥 批量秒下任务"):
-        self.bot = bot
-        self.chat_id = chat_id
         self.title = title
         self.tasks = {}
-        self.order = []
-        self.status_msg = None
-        self.last_update = 0
+        self.order = deque()
+        self.seen = 0
         self.stats = {"total": 0, "done": 0, "fail": 0}
-        self._lock = asyncio.Lock()
-
-    async def update(self, tid, icon, text, force=False):
-        if tid not in self.tasks: self.order.append(tid)
+        # 💡 只维护内存状态，发送/编辑交给共享看板服务按会话合并节流
+        self.panel = get_board(bot).open(chat_id, self.render)
+
+    def update(self, tid, icon, text):
+        if tid not in self.tasks:
+            self.seen += 1
+            self.order.append(tid)
+            # 只保留看板展示的条目，千文件批次的 UI 状态也是常数大小
+            if len(self.order) > self.DISPLAY_LIMIT: self.tasks.pop(self.order.popleft(), None)
         self.tasks[tid] = f"{icon} <code>{tid}</code> | {text}"
-        
-        now = time.time()
-        if not force and now - self.last_update < 1.5: return
-
-        async with self._lock:
-            self.last_update = time.time()
-            display_limit = 8
-            active_lines = [self.tasks[i] for i in self.order[-display_limit:]]
-            task_list_str = "\n".join(active_lines)
-            summary = f"\n... 其余 {len(self.order)-display_limit} 个文件" if len(self.order) > display_limit else ""
-            
-            text_out = (
-                f"🚀 <b>{self.title}</b>\n"
-                f"📊 状态: {self.stats['done']} / {self.stats['total']} 完成\n"
-                f"━━━━━━━━━━━━━━━\n"
-                f"{task_list_str}{summary}\n"
-                f"━━━━━━━━━━━━━━━"
-            )
-            try:
-                if self.status_msg:
-                    await self.status_msg.edit_text(text_out, parse_mode="HTML")
-                else:
-                    self.status_msg = await self.bot.send_message(self.chat_id, text_out, parse_mode="HTML")
-            except: pass
+        self.panel.touch()
+
+    def render(self):
+        task_list_str = "\n".join(self.tasks[i] for i in self.order)
+        summary = f"\n... 其余 {self.seen - len(self.order)} 个文件" if self.seen > len(self.order) else ""
+        return (
+            f"🚀 <b>{self.title}</b>\n"
+            f"📊 状态: {self.stats['done']} / {self.stats['total']} 完成\n"
+            f"━━━━━━━━━━━━━━━\n"
+            f"{task_list_str}{summary}\n"
+            f"━━━━━━━━━━━━━━━"
+        )
+
+    def close(self):
+        self.panel.close()
 
 # ===================== MTProto 下载逻辑 (原始ID + 频道名) =====================
-async def mtproto_download_logic(client, message, ui):
+async def mtproto_download_logic(client, message, ui, disk_guard=None):
     msg_id = message.id
     try:
         # 1. 解析原始 ID 和名字 (不删前缀)
@@ -78,14 +79,12 @@ async def mtproto_download_logic(client, message, ui):
         else:
             source_id = str(message.chat_id)
             try:
-                ent = await client.get_entity(message.chat_id)
+                ent = await entity_cache.get_entity(client, message.chat_id)
                 chat_name = getattr(ent, 'title', 'Private')
             except: pass
 
         # 2. 构造文件夹：download / 原始ID / 频道名字
-        safe_chat = re.sub(r'[\\/:*?"<>|]', "_", str(chat_name))
-        save_dir = os.path.join(BASE_DIR, "download", source_id, safe_chat)
-        os.makedirs(save_dir, exist_ok=True)
+        save_dir = await fs_service.chat_dir(os.path.join(BASE_DIR, "download"), source_id, chat_name)
 
         # 3. 文件名救助
         filename = f"{msg_id}"
@@ -98,26 +97,55 @@ async def mtproto_download_logic(client, message, ui):
 
         path = os.path.join(save_dir, filename)
 
-        if os.path.exists(path):
+        status, path = await media_index.plan(message, path)
+        catalog_chat = int(source_id) if source_id.lstrip("-").isdigit() else None
+        if status != "download":
+            if status == "linked": catalog.add(path, message, catalog_chat, chat_name)
             ui.stats["done"] += 1
-            await ui.update(msg_id, "🟢", "已存在", force=True)
+            ui.update(msg_id, "🟢", "已存在" if status == "exists" else "🔗 秒存")
             return
 
-        await ui.update(msg_id, "🟡", "下载中", force=False)
-        
-        # 4. 执行下载 ( temp 后缀确保原子性)
+        # 4. 执行下载 ( temp 后缀确保原子性)，磁盘低于水位线时先挂起等待空间
+        size = getattr(message.file, "size", 0) or 0
         temp_path = path + ".temp"
-        await client.download_media(message, file=temp_path)
+        if disk_guard:
+            if not await disk_guard.fits(size): ui.update(msg_id, "💾", "空间不足，等待中")
+            async with disk_guard.admit(size):
+                ui.update(msg_id, "🟡", "下载中")
+                await parallel_transfer.download_media(client, message, temp_path)
+        else:
+            ui.update(msg_id, "🟡", "下载中")
+            await parallel_transfer.download_media(client, message, temp_path)
 
-        if os.path.exists(temp_path):
-            os.rename(temp_path, path)
+        if await fs_service.rename(temp_path, path):
+            await media_index.record(message, path)
+            catalog.add(path, message, catalog_chat, chat_name)
+            media_pipeline.submit(path)
             ui.stats["done"] += 1
-            await ui.update(msg_id, "✅", "完成", force=True)
+            ui.update(msg_id, "✅", "完成")
         else: raise Exception("Save Fail")
 
     except Exception as e:
         ui.stats["fail"] += 1
-        await ui.update(msg_id, "🔴", f"失败: {str(e)[:15]}", force=True)
+        ui.update(msg_id, "🔴", f"失败: {str(e)[:15]}")
+
+async def _scheduled_download(manager, job_key, client, message, ui):
+    async with manager.download_scheduler.slot(job_key):
+        await mtproto_download_logic(client, message, ui, manager.disk_guard)
+
+async def _batch_worker(manager, user_id, session, client):
+    """批次队列消费者：最多 job_cap 个 worker 依次下载，队列空闲 BATCH_IDLE 秒后退出，最后一个退出的释放批次"""
+    queue = session["queue"]
+    while True:
+        try: message = await asyncio.wait_for(queue.get(), timeout=BATCH_IDLE)
+        except asyncio.TimeoutError:
+            if queue.empty(): break
+            continue
+        await _scheduled_download(manager, f"at_{user_id}", client, message, session["ui"])
+    session["workers"] -= 1
+    if not session["workers"]:
+        if USER_BATCH_SESSIONS.get(user_id) is session: USER_BATCH_SESSIONS.pop(user_id, None)
+        session["ui"].close()
 
 # ===================== MTProto 底层监听 (批次判定) =====================
 async def mt_on_new_message(event):
@@ -127,20 +155,23 @@ async def mt_on_new_message(event):
     if not event.message.media: return
 
     user_id = event.sender_id
-    now = time.time()
-    
-    # 3 秒批次判定逻辑
+
+    # 批次判定：批次队列仍在消费 (或空闲不足 BATCH_IDLE 秒) 时并入同一批次
     session = USER_BATCH_SESSIONS.get(user_id)
-    if session and (now - session["last_msg_time"] < 3.0):
-        ui = session["ui"]
-        session["last_msg_time"] = now
-    else:
-        ui = IndependentUI(manager.bot_app.bot, user_id)
-        USER_BATCH_SESSIONS[user_id] = {"ui": ui, "last_msg_time": now}
-    
+    if not session:
+        session = {"ui": IndependentUI(manager.bot_app.bot, user_id), "queue": asyncio.Queue(), "workers": 0}
+        USER_BATCH_SESSIONS[user_id] = session
+    # 固定数量的 worker 排空队列：转发 1000 个文件也是稳定的下载流，而不是 1000 个并发任务
+    # 空闲退出的 worker 在新消息到达时补齐，避免批次被一个大文件拖成单线程
+    while session["workers"] < manager.download_scheduler.job_cap:
+        session["workers"] += 1
+        asyncio.create_task(_batch_worker(manager, user_id, session, event.client))
+
+    ui = session["ui"]
     ui.stats["total"] += 1
-    await ui.update(event.message.id, "🔍", "准备中", force=True)
-    asyncio.create_task(mtproto_download_logic(event.client, event.message, ui))
+    ui.update(event.message.id, "🔍", "准备中")
+    # 入队后由 worker 提交到全局下载调度器：与 /dl 等任务共享槽位，同一用户的批次视为一个任务
+    session["queue"].put_nowait(event.message)
 
 # ===================== 注册入口 =====================
 # ===================== 状态指令 (修复看板分类的关键) =====================
@@ -1,16 +1,25 @@
 #openbot\features\downloader\mt_downloader.py
+import html
+import itertools
 import logging
 import os
-import time
 import asyncio
-import re
-import sqlite3
+import time
 import traceback
+from collections import deque
 from datetime import datetime
 from telegram import Update
 from telegram.ext import ContextTypes, CommandHandler
+from core import entity_cache, flood_control, parallel_transfer
+from core.catalog import catalog
 from core.command_registry import register_handler
-from telethon import types
+from core.fs_service import fs_service
+from core.job_metrics import JobMetrics
+from core.media_index import media_index
+from core.media_pipeline import media_pipeline
+from core.progress_board import get_board
+from core.sqlite_writer import BatchedSQLiteWriter
+from telethon import errors, events, types, utils
 
 logger = logging.getLogger(__name__)
 
@@ -19,98 +28,195 @@ __MODULE_NAME__ = "MTProto手动秒下引擎"
 # ===================== 0. 基础配置与数据库 =====================
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 DOWNLOAD_DIR = os.path.join(BASE_DIR, "download")
-os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 DB_PATH = os.path.join(DOWNLOAD_DIR, "download_tasks.db")
 
-batch_controls = {}
-task_semaphore = asyncio.Semaphore(10)
+# 热重载 (importlib.reload) 在同一模块字典上重新执行：沿用运行中的任务表、监控路由与任务库，
+# 否则重载后会把仍在运行的任务再恢复一份，两个协程写同一个 .temp
+batch_controls = globals().get("batch_controls", {})
+# 实时监控路由：{peer_id: {task_key: route}}，由 NewMessage/Album 事件直接查表分发
+MONITOR_ROUTES = globals().get("MONITOR_ROUTES", {})
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute('''CREATE TABLE IF NOT EXISTS dl_tasks 
-                    (jid INTEGER, msg_id INTEGER, chat_id INTEGER, chat_name TEXT, tag TEXT, status INTEGER)''')
-    conn.execute('''CREATE TABLE IF NOT EXISTS active_jobs 
-                    (jid PRIMARY KEY, link TEXT, tag TEXT, is_monitor INTEGER, user_chat_id INTEGER)''')
-    conn.commit()
-    conn.close()
+class TaskStore(BatchedSQLiteWriter):
+    """
+    下载任务库：dl_tasks 记录每条消息的下载状态，active_jobs 记录可断点恢复的任务。
+    单线程长连接与批量提交由 BatchedSQLiteWriter 负责，事件循环只做入队。
+    """
+    FLUSH_INTERVAL = 0.5   # 批量提交周期 (秒)
+    FLUSH_BATCH = 500      # 积压达到该条数时立即提交
+    THREAD_NAME = "dl_task_store"
+    LABEL = "任务库"
 
-def get_next_jid():
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        res = conn.execute("SELECT MAX(jid) FROM active_jobs").fetchone()
-        conn.close()
-        return (res[0] + 1) if res and res[0] else 1
-    except: return 1
-
-def save_active_job(jid, link, tag, is_monitor, user_chat_id):
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("INSERT OR REPLACE INTO active_jobs VALUES (?, ?, ?, ?, ?)", 
-                 (jid, link, tag, 1 if is_monitor else 0, user_chat_id))
-    conn.commit(); conn.close()
-
-def remove_active_job(jid):
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("DELETE FROM active_jobs WHERE jid = ?", (jid,))
-    conn.commit(); conn.close()
-
-def save_task(jid, msg_id, chat_id, chat_name, tag):
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("INSERT OR IGNORE INTO dl_tasks VALUES (?, ?, ?, ?, ?, 0)", (jid, msg_id, chat_id, chat_name, tag))
-    conn.commit(); conn.close()
-
-def mark_done(jid, msg_id, chat_id):
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("UPDATE dl_tasks SET status = 1 WHERE jid = ? AND msg_id = ? AND chat_id = ?", (jid, msg_id, chat_id))
-    conn.commit(); conn.close()
+    def __init__(self, db_path):
+        super().__init__(db_path)
+        self._last_jid = 0
+
+    # ---------- 线程侧 (仅在 _executor 中运行) ----------
+    def _open_sync(self):
+        conn = self._connect_sync()
+        conn.execute('''CREATE TABLE IF NOT EXISTS dl_tasks 
+                        (jid INTEGER, msg_id INTEGER, chat_id INTEGER, chat_name TEXT, tag TEXT, status INTEGER)''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS active_jobs 
+                        (jid PRIMARY KEY, link TEXT, tag TEXT, is_monitor INTEGER, user_chat_id INTEGER)''')
+        # 旧库没有唯一约束，INSERT OR IGNORE 从未生效：先清理重复行再补建唯一索引
+        has_key = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'uq_dl_tasks_key'").fetchone()
+        if not has_key:
+            conn.execute('''DELETE FROM dl_tasks WHERE rowid NOT IN 
+                            (SELECT MAX(rowid) FROM dl_tasks GROUP BY jid, chat_id, msg_id)''')
+            conn.execute("CREATE UNIQUE INDEX uq_dl_tasks_key ON dl_tasks (jid, chat_id, msg_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_dl_tasks_status ON dl_tasks (jid, status)")
+        # 断点恢复所需字段：搜刮是否完成 + 已解析的频道 ID/名称 + 监控高水位
+        cols = {r[1] for r in conn.execute("PRAGMA table_info(active_jobs)")}
+        for col, decl in (("scan_done", "INTEGER DEFAULT 0"), ("chat_id", "INTEGER"), ("chat_name", "TEXT"), ("last_msg_id", "INTEGER DEFAULT 0")):
+            if col not in cols: conn.execute(f"ALTER TABLE active_jobs ADD COLUMN {col} {decl}")
+        conn.commit()
+        # jid 同时参考两张表，避免复用已结束任务的 jid 撞上旧的 dl_tasks 记录
+        row = conn.execute("SELECT MAX(m) FROM (SELECT MAX(jid) AS m FROM active_jobs UNION ALL SELECT MAX(jid) FROM dl_tasks)").fetchone()
+        self._conn = conn
+        return (row[0] or 0) if row else 0
+
+    # ---------- 事件循环侧 ----------
+    def open(self):
+        """建表/迁移只在插件注册时执行一次"""
+        self._last_jid = self._executor.submit(self._open_sync).result()
+
+    def next_jid(self):
+        self._last_jid += 1
+        return self._last_jid
+
+    def save_active_job(self, jid, link, tag, is_monitor, user_chat_id):
+        self._enqueue("INSERT OR REPLACE INTO active_jobs (jid, link, tag, is_monitor, user_chat_id) VALUES (?, ?, ?, ?, ?)",
+                      (jid, link, tag, 1 if is_monitor else 0, user_chat_id))
+
+    def remove_active_job(self, jid):
+        self._enqueue("DELETE FROM active_jobs WHERE jid = ?", (jid,))
+
+    def save_task(self, jid, msg_id, chat_id, chat_name, tag):
+        self._enqueue("INSERT OR IGNORE INTO dl_tasks (jid, msg_id, chat_id, chat_name, tag, status) VALUES (?, ?, ?, ?, ?, 0)",
+                      (jid, msg_id, chat_id, chat_name, tag))
+
+    def mark_done(self, jid, msg_id, chat_id):
+        self._enqueue("UPDATE dl_tasks SET status = 1 WHERE jid = ? AND msg_id = ? AND chat_id = ?", (jid, msg_id, chat_id))
+
+    def mark_scan_done(self, jid, chat_id, chat_name):
+        self._enqueue("UPDATE active_jobs SET scan_done = 1, chat_id = ?, chat_name = ? WHERE jid = ?", (chat_id, chat_name, jid))
+
+    def set_high_water(self, jid, msg_id):
+        self._enqueue("UPDATE active_jobs SET last_msg_id = MAX(COALESCE(last_msg_id, 0), ?) WHERE jid = ?", (msg_id, jid))
+
+    async def load_active_jobs(self):
+        return await self.query("SELECT jid, link, tag, is_monitor, user_chat_id, scan_done, chat_id, chat_name, last_msg_id FROM active_jobs ORDER BY jid")
+
+    async def pending_ids(self, jid, chat_id):
+        rows = await self.query("SELECT msg_id FROM dl_tasks WHERE jid = ? AND chat_id = ? AND status = 0 ORDER BY msg_id DESC", (jid, chat_id))
+        return [r[0] for r in rows]
+
+    async def done_ids(self, jid):
+        rows = await self.query("SELECT msg_id FROM dl_tasks WHERE jid = ? AND status = 1", (jid,))
+        return {r[0] for r in rows}
+
+task_store = globals().get("task_store") or TaskStore(DB_PATH)
 
 # ===================== 1. UI 滚动看板 =====================
 class IndependentUI:
+    KEEP = 15
+
     def __init__(self, bot, chat_id, title="进度"):
-        self.bot = bot
-        self.chat_id = chat_id
         self.title = title
         self.tasks = {}
-        self.task_order = []
-        self.status_msg = None
-        self.lock = asyncio.Lock()
-        self.last_update = 0
+        self.task_order = deque()
         self.monitor_stats = {"total": 0, "done": 0}
+        # 💡 只维护内存状态，发送/编辑交给共享看板服务按会话合并节流
+        self.panel = get_board(bot).open(chat_id, self.render)
 
-    async def update(self, tid, icon, detail, force=False):
-        if tid not in self.tasks: self.task_order.append(tid)
+    def update(self, tid, icon, detail):
+        if tid not in self.tasks:
+            self.task_order.append(tid)
+            # 只保留看板展示的最近条目，长任务的 UI 状态不随文件数增长
+            if len(self.task_order) > self.KEEP: self.tasks.pop(self.task_order.popleft(), None)
         self.tasks[tid] = f"{icon} <code>#{tid}</code>|{detail}"
-        now = time.time()
-        if not force and (now - self.last_update < 4.0): return
-
-        async with self.lock:
-            self.last_update = time.time()
-            header = f"📦 <b>{self.title}</b>\n━━━━━━━━━━━━━━━\n"
-            stats = f"⏳ 状态: {self.monitor_stats['done']} / {self.monitor_stats['total']} 完成\n━━━━━━━━━━━━━━━\n"
-            lines = [self.tasks[id] for id in self.task_order[-15:]]
-            text = header + stats + "\n".join(lines)
-            try:
-                if self.status_msg: await self.status_msg.edit_text(text, parse_mode="HTML")
-                else: self.status_msg = await self.bot.send_message(self.chat_id, text, parse_mode="HTML")
-            except: pass
+        self.panel.touch()
+
+    def render(self):
+        header = f"📦 <b>{self.title}</b>\n━━━━━━━━━━━━━━━\n"
+        stats = f"⏳ 状态: {self.monitor_stats['done']} / {self.monitor_stats['total']} 完成\n━━━━━━━━━━━━━━━\n"
+        lines = [self.tasks[id] for id in self.task_order]
+        return header + stats + "\n".join(lines)
+
+    def close(self):
+        self.panel.close()
 
 # ===================== 2. 核心下载原子操作 (已修改路径样式) =====================
-async def _core_download_engine(client, jid, msg_id, chat_id, chat_name, ui, task_key):
+class MessageRefetcher:
+    """
+    合并重新拉取：file reference 过期等场景需要刷新 Message 时，同一会话在 WINDOW 内的请求
+    合并成一次 get_messages (每次最多 100 个 ID)，而不是每个文件单独一次 RPC。
+    """
+    WINDOW = 0.05
+    BATCH = 100
+
+    def __init__(self):
+        self._pending = {}
+
+    async def get(self, client, chat_id, msg_id):
+        key = (id(client), chat_id)
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = {}
+            asyncio.create_task(self._fire(client, chat_id, key))
+        if msg_id not in batch: batch[msg_id] = asyncio.get_running_loop().create_future()
+        # shield：同一 ID 的多个等待方共用一个 future，其中一个被取消不应连带取消其他等待方
+        return await asyncio.shield(batch[msg_id])
+
+    async def _fire(self, client, chat_id, key):
+        await asyncio.sleep(self.WINDOW)
+        batch = self._pending.pop(key, {})
+        ids = list(batch)
+        for i in range(0, len(ids), self.BATCH):
+            chunk = ids[i:i + self.BATCH]
+            try:
+                found = {m.id: m for m in await flood_control.call(client, "history", client.get_messages, chat_id, ids=chunk) if m}
+                results = [(batch[mid], found.get(mid), None) for mid in chunk]
+            except Exception as e:
+                results = [(batch[mid], None, e) for mid in chunk]
+            # 等待方可能已被取消：跳过已完成的 future，不影响同批其他等待者
+            for fut, msg, err in results:
+                if fut.done(): continue
+                if err: fut.set_exception(err)
+                else: fut.set_result(msg)
+
+message_refetcher = MessageRefetcher()
+
+async def _iter_messages_by_ids(client, chat_id, ids):
+    """按 100 个 ID 一批拉取 Message (断点恢复时库里只有 msg_id)"""
+    for i in range(0, len(ids), MessageRefetcher.BATCH):
+        for m in await flood_control.call(client, "history", client.get_messages, chat_id, ids=ids[i:i + MessageRefetcher.BATCH]):
+            if m: yield m
+
+def _media_size(m):
+    return getattr(getattr(m, "file", None), "size", 0) or 0
+
+def _job_metrics(task_key):
+    ctrl = batch_controls.get(task_key)
+    return ctrl["metrics"] if ctrl else JobMetrics()
+
+async def _core_download_engine(client, jid, m, chat_id, chat_name, ui, task_key):
+    msg_id = m.id
+    metrics = _job_metrics(task_key)
     async def cb(c, t):
         if task_key not in batch_controls or batch_controls[task_key]["cancel"]: raise Exception("STOP")
         await batch_controls[task_key]["event"].wait()
-        await ui.update(msg_id, "🔵", f"{c/1024**2:.1f}MB", force=False)
+        metrics.progress(msg_id, c, t)
+        ui.update(msg_id, "🔵", f"{c/1024**2:.1f}MB")
     
     try:
-        m = await client.get_messages(chat_id, ids=msg_id)
-        if not m or not m.media: return
+        # 💡 直接复用搜刮/监听阶段拿到的 Message，不再逐条 get_messages
+        if not m.media: return
         
         # 💡 修改点 1：使用原始 ID，不删 -100
         source_id = str(chat_id)
         
-        # 💡 修改点 2：构造精准路径：download/{source_id}/{chat_name} (移除 video/photo 层级)
-        safe_chat_name = re.sub(r'[\\/:*?"<>|]', '_', chat_name)
-        save_dir = os.path.join(DOWNLOAD_DIR, source_id, safe_chat_name)
-        os.makedirs(save_dir, exist_ok=True)
+        # 💡 修改点 2：构造精准路径：download/{source_id}/{chat_name} (移除 video/photo 层级)，目录按会话缓存、线程池创建
+        save_dir = await fs_service.chat_dir(DOWNLOAD_DIR, source_id, chat_name)
         
         # 💡 修改点 3：增强的文件名救助逻辑
         fname = f"{msg_id}"
@@ -125,72 +231,336 @@ async def _core_download_engine(client, jid, msg_id, chat_id, chat_name, ui, tas
         
         fpath = os.path.join(save_dir, fname)
         
-        # 💡 修改点 4：去重逻辑
-        if os.path.exists(fpath):
-            mark_done(jid, msg_id, chat_id)
+        # 💡 修改点 4：按内容 (文档/图片 ID + 体积) 去重，已知内容硬链接，同名异内容自动改名
+        status, fpath = await media_index.plan(m, fpath)
+        if status != "download":
+            task_store.mark_done(jid, msg_id, chat_id)
+            if status == "linked": catalog.add(fpath, m, chat_id, chat_name)
             ui.monitor_stats["done"] += 1
-            await ui.update(msg_id, "🟢", "已存在", force=True)
+            metrics.finish(msg_id, size=_media_size(m))
+            ui.update(msg_id, "🟢", "已存在" if status == "exists" else "🔗 秒存")
             return
 
-        await ui.update(msg_id, "🟡", "下载中", force=False)
-        # 💡 修改点 5：原子化保存 (.temp)
-        await client.download_media(m, file=fpath + ".temp", progress_callback=cb)
-        if os.path.exists(fpath + ".temp"):
-            os.rename(fpath + ".temp", fpath)
-            mark_done(jid, msg_id, chat_id)
+        # 💡 磁盘准入：按文件体积预留空间，低于水位线时在此挂起直到空间释放
+        size = _media_size(m)
+        if not await disk_guard.fits(size): ui.update(msg_id, "💾", "空间不足，等待中")
+        async with disk_guard.admit(size):
+            if not _job_alive(task_key): return
+            metrics.start(msg_id, size)
+            ui.update(msg_id, "🟡", "下载中")
+            # 💡 修改点 5：原子化保存 (.temp)
+            for attempt in range(2):
+                try:
+                    await parallel_transfer.download_media(client, m, fpath + ".temp", progress_callback=cb)
+                    break
+                except errors.FileReferenceExpiredError:
+                    # 引用过期 (任务暂停过久/断点恢复) 时才重新拉取，且与其他文件合并成批量请求
+                    if attempt: raise
+                    m = await message_refetcher.get(client, chat_id, msg_id)
+                    if not m or not m.media: return
+        if await fs_service.rename(fpath + ".temp", fpath):
+            await media_index.record(m, fpath)
+            catalog.add(fpath, m, chat_id, chat_name)
+            media_pipeline.submit(fpath)
+            task_store.mark_done(jid, msg_id, chat_id)
             ui.monitor_stats["done"] += 1
-            await ui.update(msg_id, "✅", "完成", force=True)
+            metrics.finish(msg_id)
+            ui.update(msg_id, "✅", "完成")
             
     except Exception as e:
-        if "STOP" not in str(e): 
+        stopped = "STOP" in str(e)
+        metrics.finish(msg_id, ok=False, size=_media_size(m), cancelled=stopped)
+        if not stopped: 
             logger.error(f"下载异常 #{msg_id}: {e}")
-            await ui.update(msg_id, "🔴", "失败", force=True)
+            ui.update(msg_id, "🔴", "失败")
+    finally:
+        metrics.abandon(msg_id)
 
 # ===================== 3. 搜刮引擎 =====================
-async def _scrape_and_run(client, bot, user_chat_id, chat_key, sub, is_monitor, jid, task_key):
-    try:
+class AlbumBuffer:
+    """
+    顺序流相册组装器：同一 grouped_id 的消息在历史流中相邻 (群聊里最多穿插少量他人消息)，
+    某组在 window 条消息内没有再出现即视为完整，整组产出。
+    """
+    def __init__(self, window=10):
+        self.window = window
+        self._groups = {}
+        self._last_seen = {}
+        self._seq = 0
+
+    def push(self, m):
+        self._seq += 1
+        ready = []
+        if m.grouped_id:
+            self._groups.setdefault(m.grouped_id, []).append(m)
+            self._last_seen[m.grouped_id] = self._seq
+        else:
+            ready.append([m])
+        for gid in [g for g, seq in self._last_seen.items() if self._seq - seq > self.window]:
+            ready.append(self._pop(gid))
+        return ready
+
+    def flush(self):
+        return [self._pop(gid) for gid in list(self._groups)]
+
+    def _pop(self, gid):
+        self._last_seen.pop(gid, None)
+        return sorted(self._groups.pop(gid), key=lambda m: m.id)
+
+ALBUM_SPAN = 9          # 相册最多 10 条，兄弟消息 ID 落在锚点 ±9 以内
+SIBLING_BATCH = 100     # get_messages 单次请求的 ID 上限
+
+async def _iter_media_units(client, ent, search_term, min_id=0, progress=None):
+    """
+    遍历历史并产出下载单元：普通媒体为单条，相册为整组 (均只含带媒体的消息)。
+    全量模式下兄弟消息本就在流中，由 AlbumBuffer 组装，不再额外请求；
+    关键字搜索只会返回带文字的那一条，兄弟消息按 100 个 ID 一批用 get_messages 补齐。
+    """
+    albums, anchors = AlbumBuffer(), []
+
+    async def resolve_anchors():
+        ids = sorted({i for a in anchors for i in range(max(1, a.id - ALBUM_SPAN), a.id + ALBUM_SPAN + 1)})
+        found = [gm for gm in await flood_control.call(client, "history", client.get_messages, ent, ids=ids) if gm and gm.grouped_id]
+        units = []
+        for a in anchors:
+            group = {gm.id: gm for gm in found if gm.grouped_id == a.grouped_id}
+            group.setdefault(a.id, a)
+            units.append(sorted(group.values(), key=lambda m: m.id))
+        anchors.clear()
+        return units
+
+    async def emit(units):
+        out = []
+        for unit in units:
+            if search_term and unit[0].grouped_id:
+                # 再加一个锚点会超出单次请求的 ID 上限时，先解析已积攒的锚点 (每批最多 5 × 19 = 95 个 ID)
+                if (len(anchors) + 1) * (2 * ALBUM_SPAN + 1) > SIBLING_BATCH: out.extend(await resolve_anchors())
+                anchors.append(unit[0])
+            else:
+                out.append(unit)
+        return out
+
+    # 💡 限流 + 可续传：FloodWait 时退避后从最后一条继续翻页
+    async for m in flood_control.iter_messages(client, ent, search=search_term, min_id=min_id):
+        if progress is not None: progress["top_id"] = max(progress["top_id"], m.id)
+        for unit in await emit(albums.push(m)):
+            media = [x for x in unit if x.media]
+            if media: yield media
+    tail = await emit(albums.flush())
+    if anchors: tail.extend(await resolve_anchors())
+    for unit in tail:
+        media = [x for x in unit if x.media]
+        if media: yield media
+
+QUEUE_SIZE = 50         # 搜刮与下载之间的有界队列长度 (背压阈值)
+
+# 全局下载调度器 (ClientManager.download_scheduler) 与磁盘准入 (ClientManager.disk_guard)，由 register 注入
+scheduler = None
+disk_guard = None
+
+def _job_alive(task_key):
+    return task_key in batch_controls and not batch_controls[task_key]["cancel"]
+
+async def _aiter(items):
+    for item in items: yield item
+
+async def _download_stream(client, jid, source, chat_id, chat_name, ui, task_key, workers=None):
+    """
+    生产者/消费者流水线：source 为异步产出 Message 的生产者，经有界队列交给 workers 个下载协程，
+    每个文件下载前向全局调度器申请槽位，与其他任务/插件公平轮转。
+    下载侧落后 (或任务暂停) 时队列写满，生产者在 put 处挂起，内存占用与历史长度无关。
+    """
+    queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    async def consumer():
         while True:
-            if task_key not in batch_controls or batch_controls[task_key]["cancel"]: break
-            try: ent = await client.get_entity(chat_key)
-            except Exception as e:
-                await bot.send_message(user_chat_id, f"❌ 任务 #{jid} 失败: {e}"); break
+            m = await queue.get()
+            if m is None: return
+            if not _job_alive(task_key): continue
+            batch_controls[task_key]["metrics"].dequeue()
+            await batch_controls[task_key]["event"].wait()
+            async with scheduler.slot(task_key):
+                await _core_download_engine(client, jid, m, chat_id, chat_name, ui, task_key)
 
-            if not batch_controls[task_key].get("ui"):
-                ui_title = f"{'监控' if is_monitor else '下载'} #{jid} | {ent.title}"
-                batch_controls[task_key]["ui"] = IndependentUI(bot, user_chat_id, ui_title)
-            
-            ui = batch_controls[task_key]["ui"]
-            all_ids, processed_groups = [], set()
-            search_term = None if sub == "all" else sub
-
-            async for m in client.iter_messages(ent, search=search_term):
-                if task_key not in batch_controls or batch_controls[task_key]["cancel"]: return
-                if not m.media: continue
-                if m.grouped_id:
-                    if m.grouped_id in processed_groups: continue
-                    processed_groups.add(m.grouped_id)
-                    async for gm in client.iter_messages(ent, min_id=m.id-10, max_id=m.id+10):
-                        if gm.grouped_id == m.grouped_id and gm.media:
-                            all_ids.append(gm.id); save_task(jid, gm.id, ent.id, ent.title, sub)
-                            await ui.update(gm.id, "🔍", "发现")
-                else:
-                    all_ids.append(m.id); save_task(jid, m.id, ent.id, ent.title, sub)
-                    await ui.update(m.id, "🔍", "发现")
-                ui.monitor_stats["total"] = len(all_ids)
-
-            if all_ids:
-                await bot.send_message(user_chat_id, f"📦 任务 #{jid} 搜刮完毕，开始下载...")
-                for i in range(0, len(all_ids), 5):
-                    if task_key not in batch_controls or batch_controls[task_key]["cancel"]: break
-                    await batch_controls[task_key]["event"].wait()
-                    async with task_semaphore:
-                        tasks = [_core_download_engine(client, jid, mid, ent.id, ent.title, ui, task_key) for mid in all_ids[i:i+5]]
-                        await asyncio.gather(*tasks)
-            if not is_monitor: break
-            await asyncio.sleep(3600)
-    except: logger.error(traceback.format_exc())
+    consumers = [asyncio.create_task(consumer()) for _ in range(workers or scheduler.job_cap)]
+    try:
+        async for m in source:
+            if not _job_alive(task_key): break
+            batch_controls[task_key]["metrics"].enqueue(_media_size(m))
+            await queue.put(m)
+    finally:
+        for _ in consumers: await queue.put(None)
+        await asyncio.gather(*consumers, return_exceptions=True)
+
+async def _download_messages(client, jid, msgs, chat_id, chat_name, ui, task_key):
+    await _download_stream(client, jid, _aiter(msgs), chat_id, chat_name, ui, task_key, workers=max(1, min(len(msgs), scheduler.job_cap)))
+
+async def _scrape_and_run(client, bot, user_chat_id, chat_key, sub, is_monitor, jid, task_key, resume=None):
+    resume = resume or {}
+    error = None
+    try:
+        # 断点恢复：搜刮已完成的任务直接续跑库中 status = 0 的记录，不再遍历历史
+        if resume.get("scan_done"):
+            chat_id, chat_name = resume["chat_id"], resume["chat_name"]
+            ui = IndependentUI(bot, user_chat_id, f"{'监控' if is_monitor else '下载'} #{jid} | {chat_name}")
+            batch_controls[task_key]["ui"] = ui
+            pending = await task_store.pending_ids(jid, chat_id)
+            ui.monitor_stats["total"] = len(pending)
+            await bot.send_message(user_chat_id, f"♻️ 任务 #{jid} 已从断点恢复，剩余 {len(pending)} 个文件")
+            await _download_stream(client, jid, _iter_messages_by_ids(client, chat_id, pending), chat_id, chat_name, ui, task_key)
+            if not is_monitor: return
+
+        if task_key not in batch_controls or batch_controls[task_key]["cancel"]: return
+        try: ent = await entity_cache.get_entity(client, chat_key)
+        except Exception as e:
+            await bot.send_message(user_chat_id, f"❌ 任务 #{jid} 失败: {e}"); return
+
+        if not batch_controls[task_key].get("ui"):
+            ui_title = f"{'监控' if is_monitor else '下载'} #{jid} | {ent.title}"
+            batch_controls[task_key]["ui"] = IndependentUI(bot, user_chat_id, ui_title)
+        
+        ui = batch_controls[task_key]["ui"]
+        search_term = None if sub == "all" else sub
+        # 已完成的消息 (含重启前) 不再重复入队
+        done_ids = await task_store.done_ids(jid)
+        # 监控任务只补齐高水位之后的消息 (首次为 0 即全量历史)；补齐期间的新消息先进 backlog
+        high_water = resume.get("high_water") or 0
+        progress = {"top_id": high_water}
+        if is_monitor: _add_monitor_route(client, ent, task_key)
+
+        async def discover():
+            found = 0
+            async for unit in _iter_media_units(client, ent, search_term, high_water, progress):
+                if not _job_alive(task_key): return
+                for m in unit:
+                    if m.id in done_ids: continue
+                    found += 1; task_store.save_task(jid, m.id, ent.id, ent.title, sub)
+                    ui.monitor_stats["total"] = found
+                    ui.update(m.id, "🔍", "发现")
+                    yield m
+            task_store.mark_scan_done(jid, ent.id, ent.title)
+            if is_monitor:
+                task_store.set_high_water(jid, progress["top_id"])
+                _drain_monitor_backlog(task_key, progress["top_id"])
+            await bot.send_message(user_chat_id, f"📦 任务 #{jid} 搜刮完毕，共发现 {found} 个文件")
+
+        # 边搜刮边下载：第一条媒体入队即开始下载
+        await _download_stream(client, jid, discover(), ent.id, ent.title, ui, task_key)
+        if is_monitor and _job_alive(task_key):
+            if not getattr(ent, "left", False):
+                await bot.send_message(user_chat_id, f"📡 任务 #{jid} 已进入实时监控，新消息将自动下载")
+            else:
+                # 账号未加入该会话：Telegram 不推送其新消息，退化为按高水位定时轮询
+                await bot.send_message(user_chat_id, f"📡 任务 #{jid} 已进入监控 (账号未加入该频道，无实时推送，每 {POLL_INTERVAL // 60} 分钟检查一次新消息)")
+                await _poll_monitor(client, task_key, ent, progress["top_id"])
+    except Exception as e:
+        error = e
+        logger.error(traceback.format_exc())
     finally:
-        if not is_monitor: remove_active_job(jid); batch_controls.pop(task_key, None)
+        ctrl = batch_controls.get(task_key)
+        if is_monitor and error is not None and _monitor_backlogged(task_key):
+            # 历史补齐失败：backlog 永远不会回放，撤销路由并结束本次运行，
+            # active_jobs 保留，重启后从上次高水位重新补齐
+            if ctrl: ctrl["cancel"] = True; ctrl["event"].set()
+            _drop_monitor_route(task_key); _close_control(task_key)
+            try: await bot.send_message(user_chat_id, f"❌ 监控任务 #{jid} 补齐历史失败，已停止: {error}")
+            except Exception: pass
+        elif not is_monitor or (ctrl and ctrl["cancel"]):
+            task_store.remove_active_job(jid); _close_control(task_key)
+
+# ===================== 3.1 实时监控 (事件驱动) =====================
+def _add_monitor_route(client, ent, task_key):
+    peer_id = utils.get_peer_id(ent)
+    MONITOR_ROUTES.setdefault(peer_id, {})[task_key] = {
+        "client": client, "chat_id": ent.id, "chat_name": ent.title, "backlog": []
+    }
+
+POLL_INTERVAL = 300     # 未加入的会话收不到 NewMessage，按该间隔用 min_id 增量补齐
+
+async def _poll_monitor(client, task_key, ent, top_id):
+    """轮询模式的实时监控：每轮拉取高水位之后的新消息，相册按 grouped_id 成组，交给与事件推送相同的入队逻辑"""
+    route = {"client": client, "chat_id": ent.id, "chat_name": ent.title}
+    while _job_alive(task_key):
+        await asyncio.sleep(POLL_INTERVAL)
+        if not _job_alive(task_key): return
+        await batch_controls[task_key]["event"].wait()
+        try: msgs = [m async for m in flood_control.iter_messages(client, ent, min_id=top_id, reverse=True)]
+        except Exception as e:
+            logger.warning(f"⚠️ 监控轮询失败 [{ent.title}]: {e}"); continue
+        if not msgs: continue
+        top_id = max(m.id for m in msgs)
+        for _, unit in itertools.groupby(msgs, key=lambda m: m.grouped_id or -m.id):
+            _enqueue_live(task_key, route, list(unit))
+
+def _drop_monitor_route(task_key):
+    for peer_id in [p for p, routes in MONITOR_ROUTES.items() if task_key in routes]:
+        MONITOR_ROUTES[peer_id].pop(task_key, None)
+        if not MONITOR_ROUTES[peer_id]: MONITOR_ROUTES.pop(peer_id, None)
+
+def _monitor_backlogged(task_key):
+    """仍处于历史补齐阶段 (新消息暂存 backlog) 的监控任务"""
+    return any(routes[task_key]["backlog"] is not None for routes in MONITOR_ROUTES.values() if task_key in routes)
+
+def _drain_monitor_backlog(task_key, top_id):
+    """历史补齐结束：回放补齐期间到达、且不在本次遍历范围内的新消息，之后改为直通"""
+    for routes in MONITOR_ROUTES.values():
+        route = routes.get(task_key)
+        if not route: continue
+        backlog, route["backlog"] = route["backlog"] or [], None
+        fresh = [m for m in backlog if m.id > top_id]
+        if fresh: _enqueue_live(task_key, route, fresh)
+
+def _enqueue_live(task_key, route, msgs):
+    ctrl = batch_controls.get(task_key)
+    if not ctrl or ctrl["cancel"]: return
+    jid, tag = ctrl["jid"], ctrl["tag"]
+    task_store.set_high_water(jid, max(m.id for m in msgs))
+    # 相册只有首条带文字，命中任意一条即整组下载
+    if tag != "all" and not any(tag.lower() in (m.message or "").lower() for m in msgs): return
+    media = [m for m in msgs if m.media]
+    if not media: return
+    for m in media: task_store.save_task(jid, m.id, route["chat_id"], route["chat_name"], tag)
+    ui = ctrl["ui"]
+    ui.monitor_stats["total"] += len(media)
+    asyncio.create_task(_download_messages(route["client"], jid, media, route["chat_id"], route["chat_name"], ui, task_key))
+
+def _dispatch_live(peer_id, msgs):
+    routes = MONITOR_ROUTES.get(peer_id)
+    if not routes: return
+    for task_key, route in list(routes.items()):
+        ctrl = batch_controls.get(task_key)
+        if not ctrl or ctrl["cancel"]:
+            routes.pop(task_key, None); continue
+        if route["backlog"] is not None: route["backlog"].extend(msgs)
+        else: _enqueue_live(task_key, route, msgs)
+    if not routes: MONITOR_ROUTES.pop(peer_id, None)
+
+async def _on_monitor_message(event):
+    # 相册交给 _on_monitor_album 整组处理
+    if event.message.grouped_id: return
+    _dispatch_live(event.chat_id, [event.message])
+
+async def _on_monitor_album(event):
+    _dispatch_live(event.chat_id, list(event.messages))
+
+async def _resume_jobs(manager):
+    """启动后从 active_jobs 重建 batch_controls，续跑重启前未完成的任务"""
+    while not (manager.bot_app and manager.bot_app.running): await asyncio.sleep(1)
+    if not manager.mtproto_client or not await manager.mtproto_client.is_authorized():
+        logger.warning("⚠️ MTProto 未授权，跳过断点任务恢复")
+        return
+
+    client, bot = manager.mtproto_client.client, manager.bot_app.bot
+    resumed = 0
+    for jid, link, tag, is_monitor, user_chat_id, scan_done, chat_id, chat_name, last_msg_id in await task_store.load_active_jobs():
+        task_key = f"{user_chat_id}_{jid}"
+        if task_key in batch_controls: continue
+        batch_controls[task_key] = _new_control(jid, tag)
+        resume = {"scan_done": bool(scan_done) and chat_id is not None, "chat_id": chat_id, "chat_name": chat_name,
+                  "high_water": last_msg_id if is_monitor and scan_done else 0}
+        asyncio.create_task(_scrape_and_run(client, bot, user_chat_id, parse_link(link), tag, bool(is_monitor), jid, task_key, resume))
+        resumed += 1
+    if resumed: logger.info(f"♻️ 已恢复 {resumed} 个断点下载任务")
 
 # ===================== 4. 指令处理器 =====================
 def parse_link(link):
@@ -201,19 +571,27 @@ def parse_link(link):
             if p.isdigit() and len(p) > 5: return int("-100" + p)
     return parts[-1]
 
+def _close_control(task_key):
+    ctrl = batch_controls.pop(task_key, None)
+    if ctrl and ctrl["ui"]: ctrl["ui"].close()
+
+def _new_control(jid, tag):
+    ctrl = {"event": asyncio.Event(), "cancel": False, "tag": tag, "jid": jid, "ui": None, "metrics": JobMetrics()}
+    ctrl["event"].set()
+    return ctrl
+
 async def handle_dl_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     manager = getattr(handle_dl_command, "manager", None) or context.bot_data.get('manager')
     if not manager or not manager.mtproto_client: return await update.message.reply_text("❌ MTProto 未就绪")
     msg = update.effective_message
     if not context.args: return await msg.reply_text("💡 用法: /dl [链接] [关键字/all]")
     
-    jid = get_next_jid(); task_key = f"{msg.chat_id}_{jid}"
+    jid = task_store.next_jid(); task_key = f"{msg.chat_id}_{jid}"
     is_monitor = "/dl_all" in msg.text
     link, sub = context.args[0].strip(), (context.args[1] if len(context.args) > 1 else "all")
     
-    save_active_job(jid, link, sub, is_monitor, msg.chat_id)
-    batch_controls[task_key] = {"event": asyncio.Event(), "cancel": False, "tag": sub, "jid": jid, "ui": None}
-    batch_controls[task_key]["event"].set()
+    task_store.save_active_job(jid, link, sub, is_monitor, msg.chat_id)
+    batch_controls[task_key] = _new_control(jid, sub)
     
     client = manager.mtproto_client.client
     if not client.is_connected(): await client.connect()
@@ -221,12 +599,54 @@ async def handle_dl_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def handle_dls_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not batch_controls: return await update.message.reply_text("📭 当前没有运行中的批量任务")
-    lines = ["📑 <b>活跃下载任务列表:</b>"]
+    if context.args:
+        # /dls <任务ID>：单任务详细吞吐统计
+        tid = context.args[0].lstrip("#")
+        key = next((k for k, c in batch_controls.items() if str(c["jid"]) == tid), None)
+        if not key: return await update.message.reply_text("⚠️ 任务不存在")
+        ctrl = batch_controls[key]
+        status = "▶️ 运行中" if ctrl["event"].is_set() else "⏸ 已暂停"
+        text = (f"📊 <b>任务 #{tid}</b> | {status} | 标签: {ctrl['tag']}\n"
+                f"🎛 槽位: {scheduler.job_busy(key)} 占用 / {scheduler.job_waiting(key)} 等待\n"
+                f"{ctrl['metrics'].report()}")
+        return await update.message.reply_text(text, parse_mode="HTML")
+    lines = ["📑 <b>活跃下载任务列表:</b>", f"🎛 下载槽位: {scheduler.busy} / {scheduler.size} 占用 (单任务上限 {scheduler.job_cap})"]
+    manager = handle_dls_command.manager
+    if manager.mtproto_client: lines.append(manager.mtproto_client.flood_control.report())
     for key, ctrl in batch_controls.items():
         status = "▶️ 运行中" if ctrl["event"].is_set() else "⏸ 已暂停"
-        lines.append(f"任务 <code>#{ctrl['jid']}</code> | {status} | 标签: {ctrl['tag']}")
+        lines.append(f"任务 <code>#{ctrl['jid']}</code> | {status} | 标签: {ctrl['tag']} | 槽位: {scheduler.job_busy(key)}")
+        lines.append(f"    {ctrl['metrics'].summary()}")
     await update.message.reply_text("\n".join(lines), parse_mode="HTML")
 
+async def handle_dl_find(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/dl_find 关键字 [过滤条件]：检索已下载文件目录"""
+    msg = update.effective_message
+    if not context.args:
+        total, size = await catalog.count()
+        return await msg.reply_text(
+            f"📚 文件目录已收录 {total} 个文件 ({size / 1024**3:.1f} GB)\n"
+            f"💡 用法: /dl_find 关键字 [chat:ID或名称] [type:video|photo|audio|doc] [ext:mp4] [size>100M] [after:2024-01-01] [before:2024-12-31]\n"
+            f"🔄 /dl_find --backfill 重新扫描下载目录补录")
+    if context.args[0] == "--backfill":
+        # 遍历整棵下载目录可能很久：放到后台任务，不占住 PTB 的更新处理
+        async def run_backfill():
+            added = await catalog.backfill(force=True)
+            await msg.reply_text(f"📚 补录完成，新增 {added} 个文件")
+        context.application.create_task(run_backfill())
+        return await msg.reply_text("🔄 正在后台补录下载目录，完成后通知")
+
+    started = time.perf_counter()
+    rows = await catalog.search(" ".join(context.args))
+    cost = (time.perf_counter() - started) * 1000
+    if not rows: return await msg.reply_text(f"🔍 未找到匹配文件 ({cost:.0f}ms)")
+    lines = [f"🔍 <b>找到 {len(rows)} 个文件</b> ({cost:.0f}ms)"]
+    for path, size, chat_name, msg_id, date in rows:
+        rel = os.path.relpath(path, DOWNLOAD_DIR)
+        day = datetime.fromtimestamp(date).strftime("%Y-%m-%d") if date else "-"
+        lines.append(f"📄 <code>{html.escape(rel[-80:])}</code>\n    {(size or 0) / 1024**2:.1f}MB | {html.escape(chat_name or '-')} #{msg_id or '-'} | {day}")
+    await msg.reply_text("\n".join(lines), parse_mode="HTML")
+
 async def handle_dl_control(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = update.effective_message
     if not context.args: return
@@ -238,15 +658,35 @@ async def handle_dl_control(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif "continue" in cmd: batch_controls[target_key]["event"].set(); await msg.reply_text(f"▶️ 任务 #{tid} 已恢复")
     elif "no" in cmd: 
         batch_controls[target_key]["cancel"] = True; batch_controls[target_key]["event"].set()
-        remove_active_job(int(tid)); await msg.reply_text(f"⏹ 任务 #{tid} 已取消")
+        _close_control(target_key); _drop_monitor_route(target_key)
+        task_store.remove_active_job(int(tid)); await msg.reply_text(f"⏹ 任务 #{tid} 已取消")
 
 # ===================== 5. 统一注册 =====================
 def register(manager):
-    init_db()
+    global scheduler, disk_guard
+    scheduler = manager.download_scheduler
+    disk_guard = manager.disk_guard
+    loop = asyncio.get_event_loop()
+    # 任务库打开、写入循环与断点恢复每个进程只执行一次 (热重载时任务库已在运行)
+    if task_store._conn is None:
+        task_store.open()
+        loop.create_task(task_store.run())
+        loop.create_task(_resume_jobs(manager))
+    # 停机时落盘 0.5 秒写队列中的积压 (mark_done / set_high_water / remove_active_job)
+    manager.shutdown_hooks[__name__] = task_store.close
+
+    # 实时监控事件：先按函数名移除旧挂载 (含热重载前的旧函数对象)，防止重复分发
+    client = manager.mtproto_client.client
+    for cb, _ in client.list_event_handlers():
+        if getattr(cb, "__module__", None) == __name__ and cb.__name__ in ("_on_monitor_message", "_on_monitor_album"):
+            client.remove_event_handler(cb)
+    client.add_event_handler(_on_monitor_message, events.NewMessage)
+    client.add_event_handler(_on_monitor_album, events.Album)
     handle_dl_command.manager = handle_dl_control.manager = handle_dls_command.manager = manager
     register_handler(CommandHandler("dl", handle_dl_command), __name__)
     register_handler(CommandHandler("dl_all", handle_dl_command), __name__)
     register_handler(CommandHandler("dls", handle_dls_command), __name__)
+    register_handler(CommandHandler("dl_find", handle_dl_find), __name__)
     register_handler(CommandHandler("dl_stop", handle_dl_control), __name__)
     register_handler(CommandHandler("dl_continue", handle_dl_control), __name__)
     register_handler(CommandHandler("dl_no", handle_dl_control), __name__)
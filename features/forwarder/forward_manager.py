@@ -5,10 +5,15 @@ import logging
 import hashlib
 import re
 import random
+import time
+from collections import OrderedDict
 from datetime import datetime
 from telegram import Update
+from telegram.error import RetryAfter
 from telegram.ext import ContextTypes, CommandHandler, MessageHandler, filters
 from core.command_registry import register_handler
+from core.flood_control import TokenBucket
+from core.sqlite_writer import BatchedSQLiteWriter
 
 # --- 插件元数据 ---
 __MODULE_NAME__ = "超级转发器"
@@ -18,86 +23,221 @@ logger = logging.getLogger(__name__)
 DATA_DIR = "转发数据"
 os.makedirs(DATA_DIR, exist_ok=True)
 
+def _read_json(path):
+    if not os.path.exists(path): return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f: return json.load(f)
+    except: return {}
+
+def _fingerprint(msg):
+    """
+    去重指纹：文字去空白后 MD5；带媒体时再拼上 file_unique_id (同一文件跨会话/转发不变)，
+    无说明文字的图片/视频不会再全部撞上同一个空串哈希。既无媒体也无文字时返回 None (不去重)。
+    """
+    text = re.sub(r'\s+', '', msg.text or msg.caption or "")
+    att = msg.effective_attachment
+    if isinstance(att, (tuple, list)): att = att[-1] if att else None  # 图片取最大尺寸
+    uid = getattr(att, "file_unique_id", None)
+    if not uid and not text: return None
+    return hashlib.md5(f"{uid}|{text}".encode() if uid else text.encode()).hexdigest()
+
+class SeenSet:
+    """
+    有界去重集合：指纹 -> 首次入库时间，按时间顺序保存；
+    超过 TTL 视为过期，超过 MAX 条淘汰最旧的，内存占用固定，不再随运行时间无限增长。
+    """
+    TTL = 7 * 86400
+    MAX = 100_000
+
+    def __init__(self, items=()):
+        self._items = OrderedDict(items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        ts = self._items.get(key)
+        return ts is not None and time.time() - ts < self.TTL
+
+    def add(self, key, ts=None):
+        self._items[key] = ts or time.time()
+        self._items.move_to_end(key)
+        cutoff = time.time() - self.TTL
+        while self._items:
+            oldest = next(iter(self._items.values()))
+            if len(self._items) <= self.MAX and oldest >= cutoff: break
+            self._items.popitem(last=False)
+
+class ForwardStore(BatchedSQLiteWriter):
+    """
+    转发器状态库：配置、待发缓冲、去重指纹逐行存入 SQLite (WAL)，每条新消息只写一行，不再整体重写 JSON。
+    与下载任务库相同经 BatchedSQLiteWriter 合并成一个事务提交，崩溃时不会留下半截状态。
+    """
+    FLUSH_INTERVAL = 1.0
+    FLUSH_BATCH = 200
+    THREAD_NAME = "fw_store"
+    LABEL = "转发数据"
+    SECTIONS = ("sources", "destinations", "rules", "tasks")
+
+    # ---------- 线程侧 ----------
+    def _open_sync(self):
+        conn = self._connect_sync()
+        conn.execute("CREATE TABLE IF NOT EXISTS fw_config (section TEXT, key TEXT, value TEXT, PRIMARY KEY (section, key))")
+        conn.execute("CREATE TABLE IF NOT EXISTS fw_pending (id INTEGER PRIMARY KEY, src TEXT, entry TEXT)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_fw_pending_src ON fw_pending (src, id)")
+        conn.execute("CREATE TABLE IF NOT EXISTS fw_seen (key TEXT PRIMARY KEY, ts REAL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_fw_seen_ts ON fw_seen (ts)")
+        conn.execute("CREATE TABLE IF NOT EXISTS fw_meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.commit()
+        self._migrate_json(conn)
+        self._conn = conn
+
+        config = {s: {} for s in self.SECTIONS}
+        for section, key, value in conn.execute("SELECT section, key, value FROM fw_config"):
+            config.setdefault(section, {})[key] = json.loads(value)
+        pending = {}
+        for src, entry in conn.execute("SELECT src, entry FROM fw_pending ORDER BY id"):
+            pending.setdefault(src, []).append(json.loads(entry))
+        self._prune_sync(time.time() - SeenSet.TTL, SeenSet.MAX)
+        seen = conn.execute("SELECT key, ts FROM fw_seen ORDER BY ts").fetchall()
+        row = conn.execute("SELECT value FROM fw_meta WHERE key = 'last_cron'").fetchone()
+        return config, {"pending": pending, "seen": seen, "last_cron": row[0] if row else ""}
+
+    def _migrate_json(self, conn):
+        """旧版 config.json / pending_cache.json 一次性导入，成功后改名为 .bak"""
+        if conn.execute("SELECT 1 FROM fw_meta WHERE key = 'json_migrated'").fetchone(): return
+        data_dir = os.path.dirname(self.db_path)
+        paths = [os.path.join(data_dir, name) for name in ("config.json", "pending_cache.json")]
+        config, cache = (_read_json(p) for p in paths)
+        with conn:
+            for section, items in config.items():
+                conn.executemany("INSERT OR REPLACE INTO fw_config VALUES (?, ?, ?)",
+                                 [(section, k, json.dumps(v, ensure_ascii=False)) for k, v in items.items()])
+            for src, entries in cache.get("pending", {}).items():
+                conn.executemany("INSERT INTO fw_pending (src, entry) VALUES (?, ?)",
+                                 [(src, json.dumps(e, ensure_ascii=False)) for e in entries])
+            conn.executemany("INSERT OR REPLACE INTO fw_seen VALUES (?, CAST(strftime('%s', ?) AS REAL))",
+                             cache.get("hashes", {}).items())
+            if cache.get("last_cron"): conn.execute("INSERT OR REPLACE INTO fw_meta VALUES ('last_cron', ?)", (cache["last_cron"],))
+            conn.execute("INSERT OR REPLACE INTO fw_meta VALUES ('json_migrated', ?)", (datetime.now().isoformat(),))
+        for p in paths:
+            if os.path.exists(p):
+                os.replace(p, p + ".bak")
+                logger.info(f"📦 已迁移旧版转发数据: {os.path.basename(p)}")
+
+    def _prune_sync(self, cutoff, limit):
+        """删除过期指纹，并只保留最新的 limit 条"""
+        with self._conn:
+            self._conn.execute("DELETE FROM fw_seen WHERE ts < ?", (cutoff,))
+            self._conn.execute("DELETE FROM fw_seen WHERE key IN (SELECT key FROM fw_seen ORDER BY ts DESC LIMIT -1 OFFSET ?)", (limit,))
+
+    # ---------- 事件循环侧 ----------
+    def open(self):
+        """建表与旧数据迁移只在插件注册时执行一次，返回 (config, cache)"""
+        return self._executor.submit(self._open_sync).result()
+
+    def set_config(self, section, key, value):
+        self._enqueue("INSERT OR REPLACE INTO fw_config VALUES (?, ?, ?)", (section, key, json.dumps(value, ensure_ascii=False)))
+
+    def add_pending(self, src, entry):
+        self._enqueue("INSERT INTO fw_pending (src, entry) VALUES (?, ?)", (src, json.dumps(entry, ensure_ascii=False)))
+
+    def clear_pending(self, src):
+        self._enqueue("DELETE FROM fw_pending WHERE src = ?", (src,))
+
+    def add_seen(self, key, ts):
+        self._enqueue("INSERT OR REPLACE INTO fw_seen VALUES (?, ?)", (key, ts))
+
+    async def prune_seen(self, cutoff, limit):
+        await self.flush()
+        try: await self._call(self._prune_sync, cutoff, limit)
+        except Exception as e: logger.error(f"❌ 去重记录清理失败: {e}")
+
 class ForwardEngineV3:
+    # 令牌桶 (每秒条数, 突发容量)：Bot API 全局约 30 条/秒，同一群组约 20 条/分钟
+    GLOBAL_RATE = (25, 30)
+    DEST_RATE = (20 / 60, 3)
+    SEND_RETRIES = 3
+
     def __init__(self, manager):
         self.manager = manager
-        self.config = self._load("config.json", {"sources": {}, "destinations": {}, "rules": {}, "tasks": {}})
-        self.cache = self._load("pending_cache.json", {"pending": {}, "hashes": {}, "last_cron": ""})
+        self.store = ForwardStore(os.path.join(DATA_DIR, "forward.db"))
+        self.config, self.cache = self.store.open()
+        self.seen = SeenSet(self.cache.pop("seen"))
+        # 反向索引：会话 ID -> 源编号，消息热路径 O(1) 查找
+        self.source_index = {}
+        self._rebuild_source_index()
         self.media_groups = {}  
         self.running_locks = set()
-        self._needs_save = False
-
-    def _load(self, filename, default):
-        path = os.path.join(DATA_DIR, filename)
-        if os.path.exists(path):
-            try:
-                with open(path, 'r', encoding='utf-8') as f: return json.load(f)
-            except: return default
-        return default
+        self.tasks = []
+        self.global_bucket = TokenBucket(*self.GLOBAL_RATE)
+        self.dest_buckets = {}
 
-    def save(self):
-        """标记需要保存，由后台任务统一写入，防止频繁 IO 阻塞"""
-        self._needs_save = True
+    def set_config(self, section, key, value):
+        """修改内存配置并增量落盘 (只写这一行)"""
+        self.config[section][key] = value
+        self.store.set_config(section, key, value)
+        if section == "sources": self._rebuild_source_index()
 
-    async def _io_loop(self):
-        """每 5 秒检查一次是否需要持久化数据"""
-        while True:
-            if self._needs_save:
-                try:
-                    with open(os.path.join(DATA_DIR, "config.json"), 'w', encoding='utf-8') as f:
-                        json.dump(self.config, f, ensure_ascii=False, indent=4)
-                    with open(os.path.join(DATA_DIR, "pending_cache.json"), 'w', encoding='utf-8') as f:
-                        json.dump(self.cache, f, ensure_ascii=False, indent=4)
-                    self._needs_save = False
-                except Exception as e:
-                    logger.error(f"❌ 数据保存失败: {e}")
-            await asyncio.sleep(5)
+    def _rebuild_source_index(self):
+        """源绑定变化时重建 (/fw_src 与启动加载)，同一会话重复绑定时以先登记的编号为准"""
+        index = {}
+        for code, chat_id in self.config["sources"].items(): index.setdefault(str(chat_id).strip(), code)
+        self.source_index = index
 
     # ================= 核心：内容搜刮与清洗 =================
     async def handle_incoming(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        if not update.message or not update.effective_chat: return
-        
-        chat_id = str(update.effective_chat.id)
-        # 【关键修复】: 只有在 sources 列表里的群组才会被拦截。
+        chat = update.effective_chat
+        # 【关键修复】: 只有在 sources 列表里的群组才会被拦截，未绑定的会话在做任何其他工作前直接返回。
         # 这样你在私聊输入手机号时，这里会直接跳过，不会抢占输入流。
-        src_code = next((k for k, v in self.config["sources"].items() if str(v) == chat_id), None)
-        if not src_code: return 
+        src_code = self.source_index.get(str(chat.id)) if chat else None
+        if not src_code or not update.message: return 
 
         msg = update.message
-        # 1. 深度内容去重 (忽略空格)
-        text = msg.text or msg.caption or ""
-        content_hash = hashlib.md5(re.sub(r'\s+', '', text).encode()).hexdigest()
-        if content_hash in self.cache["hashes"]: return
+        # 1. 深度内容去重 (忽略空格，媒体按 file_unique_id)
+        fp = _fingerprint(msg)
+        if fp and fp in self.seen: return
 
         # 2. 相册聚合逻辑
         if msg.media_group_id:
             gid = msg.media_group_id
             if gid not in self.media_groups:
                 self.media_groups[gid] = []
-                asyncio.create_task(self._wait_and_store_group(gid, src_code, content_hash))
+                asyncio.create_task(self._wait_and_store_group(gid, src_code))
             self.media_groups[gid].append(msg)
         else:
-            self._store_entry(src_code, msg, content_hash)
+            self._store_entry(src_code, msg, [fp])
 
-    async def _wait_and_store_group(self, gid, src_code, content_hash):
+    async def _wait_and_store_group(self, gid, src_code):
         await asyncio.sleep(3.5) 
         msgs = self.media_groups.pop(gid, [])
         if msgs:
-            self._store_entry(src_code, msgs[0], content_hash, is_group=True)
+            # 相册保留全部消息 ID (copy_messages 要求升序)，说明文字取带 caption 的那一条
+            msgs.sort(key=lambda m: m.message_id)
+            head = next((m for m in msgs if m.caption), msgs[0])
+            self._store_entry(src_code, head, [_fingerprint(m) for m in msgs], msg_ids=[m.message_id for m in msgs])
+
+    def _mark_seen(self, fingerprints):
+        now = time.time()
+        for fp in fingerprints:
+            if not fp: continue
+            self.seen.add(fp, now)
+            self.store.add_seen(fp, now)
 
-    def _store_entry(self, src_code, msg, content_hash, is_group=False):
+    def _store_entry(self, src_code, msg, fingerprints, msg_ids=None):
         if src_code not in self.cache["pending"]: self.cache["pending"][src_code] = []
         
         entry = {
             "msg_id": msg.message_id,
             "chat_id": msg.chat_id,
             "text": msg.text or msg.caption or "",
-            "is_group": is_group,
+            "is_group": bool(msg_ids),
             "timestamp": datetime.now().isoformat()
         }
+        if msg_ids: entry["msg_ids"] = msg_ids
         self.cache["pending"][src_code].append(entry)
-        self.cache["hashes"][content_hash] = datetime.now().strftime("%Y-%m-%d %H:%M")
-        self.save()
+        self.store.add_pending(src_code, entry)
+        self._mark_seen(fingerprints)
 
     # ================= 核心：破防重传分发器 =================
     async def dispatch(self, tid):
@@ -110,26 +250,59 @@ class ForwardEngineV3:
             dst_ids = self.config["destinations"].get(task['dst'], [])
             rule = self.config["rules"].get(task['rule'], {})
             pending = self.cache["pending"].pop(task['src'], [])
-            self.save()
-
-            for item in pending:
-                final_text = self._apply_cleaning(item['text'], rule)
-                for target_id in dst_ids:
-                    try:
-                        # 使用 copy_message 强制穿透“禁止转发”限制
-                        await self.manager.bot.copy_message(
-                            chat_id=target_id,
-                            from_chat_id=item['chat_id'],
-                            message_id=item['msg_id'],
-                            caption=final_text,
-                            parse_mode="HTML"
-                        )
-                        await asyncio.sleep(1.2) # 防封控流控
-                    except Exception as e:
-                        logger.error(f"❌ 转发失败: {e}")
+            self.store.clear_pending(task['src'])
+
+            if not pending or not dst_ids: return
+
+            # 各目标并发分发，目标内按入库顺序逐条发送；速率由令牌桶控制，不再固定休眠
+            captions = [self._apply_cleaning(item['text'], rule) for item in pending]
+            results = await asyncio.gather(*(self._fan_out(target_id, pending, captions) for target_id in dst_ids))
+            logger.info(f"📤 任务 {tid} 分发完成: {len(pending)} 条 × {len(dst_ids)} 个目标，成功 {sum(results)}")
         finally:
             self.running_locks.remove(tid)
 
+    async def _fan_out(self, target_id, pending, captions):
+        sent = 0
+        for item, caption in zip(pending, captions):
+            sent += await self._send(target_id, item, caption)
+        return sent
+
+    async def _send(self, target_id, item, caption):
+        bucket = self.dest_buckets.get(target_id)
+        if bucket is None: bucket = self.dest_buckets[target_id] = TokenBucket(*self.DEST_RATE)
+        bot = self.manager.bot
+
+        if len(item.get("msg_ids") or []) > 1:
+            # 整个相册一次 copy_messages (该接口不支持 caption)，再把清洗后的说明文字写到首条
+            copied = await self._limited(bucket, target_id, bot.copy_messages, chat_id=target_id,
+                                         from_chat_id=item['chat_id'], message_ids=item['msg_ids'], remove_caption=True)
+            if not copied: return False
+            await self._limited(bucket, target_id, bot.edit_message_caption, chat_id=target_id,
+                                message_id=copied[0].message_id, caption=caption, parse_mode="HTML")
+            return True
+
+        # 使用 copy_message 强制穿透“禁止转发”限制
+        return await self._limited(bucket, target_id, bot.copy_message, chat_id=target_id, from_chat_id=item['chat_id'],
+                                   message_id=item['msg_id'], caption=caption, parse_mode="HTML") is not None
+
+    async def _limited(self, bucket, target_id, fn, **kwargs):
+        """先取目标会话令牌再取全局令牌；429 时按服务器给出的 retry_after 暂停该目标的桶后重试，失败返回 None"""
+        for _ in range(self.SEND_RETRIES + 1):
+            await bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                return await fn(**kwargs)
+            except RetryAfter as e:
+                wait = e.retry_after
+                wait = wait.total_seconds() if hasattr(wait, "total_seconds") else float(wait)
+                bucket.penalize(wait)
+                logger.warning(f"🚦 目标 {target_id} 触发限流，{wait:.0f}s 后重试")
+            except Exception as e:
+                logger.error(f"❌ 转发失败: {e}")
+                return None
+        logger.error(f"❌ 转发失败: 目标 {target_id} 多次限流，已放弃")
+        return None
+
     def _apply_cleaning(self, text, rule):
         suffix = f"\n\n{rule.get('suffix', '')}"
         tags = re.findall(r'#\w+', text)
@@ -142,35 +315,37 @@ class ForwardEngineV3:
 # ================= 业务指令注册 =================
 
 def register(manager):
-    engine = ForwardEngineV3(manager)
+    global _engine
+    # 热重载：先停掉旧引擎的后台循环并同步落盘，再打开新库，避免泄漏连接/线程和重复分发
+    old = globals().get("_engine")
+    if old:
+        for t in old.tasks: t.cancel()
+        old.store.close_now()
+    engine = _engine = ForwardEngineV3(manager)
 
     async def fw_src(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if len(context.args) < 2: return await update.message.reply_html("格式: /fw_src 601 ID")
-        engine.config["sources"][context.args[0]] = context.args[1]
-        engine.save()
+        engine.set_config("sources", context.args[0], context.args[1])
         await update.message.reply_html(f"✅ <b>源已绑定</b>: {context.args[0]}")
 
     async def fw_dst(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if len(context.args) < 2: return await update.message.reply_html("格式: /fw_dst 701 ID1,ID2")
-        engine.config["destinations"][context.args[0]] = [i.strip() for i in context.args[1].split(',')]
-        engine.save()
+        engine.set_config("destinations", context.args[0], [i.strip() for i in context.args[1].split(',')])
         await update.message.reply_html(f"✅ <b>目标组已绑定</b>: {context.args[0]}")
 
     async def fw_rule(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if len(context.args) < 3: return await update.message.reply_html("格式: /fw_rule 801 20:00 后缀")
-        engine.config["rules"][context.args[0]] = {"time": context.args[1], "suffix": " ".join(context.args[2:])}
-        engine.save()
+        engine.set_config("rules", context.args[0], {"time": context.args[1], "suffix": " ".join(context.args[2:])})
         await update.message.reply_html(f"✅ <b>规则已建立</b>: {context.args[0]}")
 
     async def fw_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if len(context.args) < 3: return
         tid = f"9{random.randint(100, 999)}"
-        engine.config["tasks"][tid] = {"src": context.args[0], "dst": context.args[1], "rule": context.args[2]}
-        engine.save()
+        engine.set_config("tasks", tid, {"src": context.args[0], "dst": context.args[1], "rule": context.args[2]})
         await update.message.reply_html(f"🚀 <b>任务已开启</b>: {tid}")
 
     async def fw_show_lib(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        msg = f"🔄 <b>转发器快照 V3.8</b>\n📥 源: {len(engine.config['sources'])}\n📤 目的: {len(engine.config['destinations'])}\n🚀 任务: {len(engine.config['tasks'])}"
+        msg = f"🔄 <b>转发器快照 V3.8</b>\n📥 源: {len(engine.config['sources'])}\n📤 目的: {len(engine.config['destinations'])}\n🚀 任务: {len(engine.config['tasks'])}\n🧬 去重记录: {len(engine.seen)}"
         await update.message.reply_html(msg)
 
     async def cron_loop():
@@ -181,8 +356,11 @@ def register(manager):
                     rule = engine.config["rules"].get(info['rule'])
                     if rule and rule['time'] == now_str:
                         asyncio.create_task(engine.dispatch(tid))
+                # 每小时整点清理库中过期/超额的去重记录 (内存侧由 SeenSet 自行淘汰)
+                if now_str.endswith(":00"):
+                    asyncio.create_task(engine.store.prune_seen(time.time() - SeenSet.TTL, SeenSet.MAX))
                 await asyncio.sleep(60)
-            except: await asyncio.sleep(10)
+            except Exception: await asyncio.sleep(10)
 
     # 注册处理器 (使用 Group 1 避免干扰核心登录逻辑)
     register_handler(CommandHandler("fw_src", fw_src), __name__)
@@ -196,6 +374,6 @@ def register(manager):
 
     # 启动后台 IO 循环与任务调度
     loop = asyncio.get_event_loop()
-    loop.create_task(engine._io_loop())
-    loop.create_task(cron_loop())
+    engine.tasks = [loop.create_task(engine.store.run()), loop.create_task(cron_loop())]
+    manager.shutdown_hooks[__name__] = engine.store.close
     logger.info(f"✅ [{__MODULE_NAME__}] 工业级引擎已启动")